@@ -0,0 +1,196 @@
+import sqlite3
+import threading
+import time
+
+from config import Config
+
+# Ratings run from 1 to RATING_MAX stars
+RATING_MAX = 5
+
+# Entity ids per SELECT, below SQLite's bound-parameter limit
+_BATCH = 500
+
+_HISTOGRAM = ', '.join(f"rated_{stars}" for stars in range(1, RATING_MAX + 1))
+
+
+class AggregateStore:
+    """
+    Likes and ratings of entities, with their aggregates kept up to date, in SQLite.
+
+    Every write updates its entity's row of aggregates in the same
+    transaction: total likes, distinct likers, and the count, sum and 1-5
+    histogram of ratings. Reading an entity's score is therefore a single
+    primary-key lookup, however many users voted.
+
+    Per user, only the latest rating of each entity is kept: rating again
+    replaces the earlier vote, in the aggregates too, so a user's history
+    never grows past one row per entity they rated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS likes ("
+                " entity_type TEXT NOT NULL,"
+                " entity_id TEXT NOT NULL,"
+                " username TEXT NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " PRIMARY KEY (entity_type, entity_id, username))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ratings ("
+                " entity_type TEXT NOT NULL,"
+                " entity_id TEXT NOT NULL,"
+                " username TEXT NOT NULL,"
+                " rating INTEGER NOT NULL,"
+                " rated_at REAL NOT NULL,"
+                " PRIMARY KEY (entity_type, entity_id, username))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entity_aggregates ("
+                " entity_type TEXT NOT NULL,"
+                " entity_id TEXT NOT NULL,"
+                " likes INTEGER NOT NULL DEFAULT 0,"
+                " likers INTEGER NOT NULL DEFAULT 0,"
+                " ratings INTEGER NOT NULL DEFAULT 0,"
+                " rating_sum INTEGER NOT NULL DEFAULT 0,"
+                + ''.join(f" rated_{stars} INTEGER NOT NULL DEFAULT 0," for stars in range(1, RATING_MAX + 1)) +
+                " PRIMARY KEY (entity_type, entity_id))"
+            )
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def like(self, entity_type, entity_id, username):
+        with self._connection() as conn:
+            first = conn.execute(
+                "INSERT INTO likes (entity_type, entity_id, username, count) VALUES (?, ?, ?, 1)"
+                " ON CONFLICT(entity_type, entity_id, username) DO NOTHING",
+                (entity_type, entity_id, username)
+            ).rowcount == 1
+            if not first:
+                conn.execute(
+                    "UPDATE likes SET count = count + 1 WHERE entity_type = ? AND entity_id = ? AND username = ?",
+                    (entity_type, entity_id, username)
+                )
+            conn.execute(
+                "INSERT INTO entity_aggregates (entity_type, entity_id, likes, likers) VALUES (?, ?, 1, ?)"
+                " ON CONFLICT(entity_type, entity_id) DO UPDATE SET"
+                " likes = likes + 1, likers = likers + excluded.likers",
+                (entity_type, entity_id, int(first))
+            )
+
+    def rate(self, entity_type, entity_id, username, rating):
+        """
+        Records a user's rating of an entity, replacing any earlier one.
+
+        Raises:
+            ValueError: If the rating is not a whole number of stars from 1 to 5.
+        """
+        if not isinstance(rating, int) or not 1 <= rating <= RATING_MAX:
+            raise ValueError(f"Rating must be from 1 to {RATING_MAX}, got {rating!r}")
+
+        with self._connection() as conn:
+            # Taking the write lock first keeps the old rating from changing
+            # between reading it and adjusting the aggregates
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT rating FROM ratings WHERE entity_type = ? AND entity_id = ? AND username = ?",
+                (entity_type, entity_id, username)
+            ).fetchone()
+            previous = row[0] if row is not None else None
+            conn.execute(
+                "INSERT INTO ratings (entity_type, entity_id, username, rating, rated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT(entity_type, entity_id, username) DO UPDATE SET"
+                " rating = excluded.rating, rated_at = excluded.rated_at",
+                (entity_type, entity_id, username, rating, time.time())
+            )
+            conn.execute(
+                "INSERT INTO entity_aggregates (entity_type, entity_id) VALUES (?, ?)"
+                " ON CONFLICT(entity_type, entity_id) DO NOTHING",
+                (entity_type, entity_id)
+            )
+            if previous is None:
+                conn.execute(
+                    f"UPDATE entity_aggregates SET ratings = ratings + 1, rating_sum = rating_sum + ?,"
+                    f" rated_{rating} = rated_{rating} + 1 WHERE entity_type = ? AND entity_id = ?",
+                    (rating, entity_type, entity_id)
+                )
+            elif previous != rating:
+                conn.execute(
+                    f"UPDATE entity_aggregates SET rating_sum = rating_sum + ?,"
+                    f" rated_{previous} = rated_{previous} - 1, rated_{rating} = rated_{rating} + 1"
+                    f" WHERE entity_type = ? AND entity_id = ?",
+                    (rating - previous, entity_type, entity_id)
+                )
+
+    def user_rating(self, entity_type, entity_id, username):
+        """
+        Returns the user's latest rating of the entity, or None.
+        """
+        row = self._connection().execute(
+            "SELECT rating FROM ratings WHERE entity_type = ? AND entity_id = ? AND username = ?",
+            (entity_type, entity_id, username)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def get_many(self, entity_type, entity_ids):
+        """
+        Returns {entity_id: aggregates} for the given entities of one type.
+
+        Aggregates are dicts of likes, likers, ratings, average (None before
+        the first rating) and histogram, the counts of 1 to 5 star ratings.
+        Entities nobody liked or rated get all-zero aggregates.
+        """
+        entity_ids = list(dict.fromkeys(entity_ids))
+        rows = {}
+        conn = self._connection()
+        for start in range(0, len(entity_ids), _BATCH):
+            batch = entity_ids[start:start + _BATCH]
+            rows.update(
+                (row[0], row[1:]) for row in conn.execute(
+                    f"SELECT entity_id, likes, likers, ratings, rating_sum, {_HISTOGRAM} FROM entity_aggregates"
+                    f" WHERE entity_type = ? AND entity_id IN ({', '.join('?' * len(batch))})",
+                    [entity_type] + batch
+                )
+            )
+
+        aggregates = {}
+        for entity_id in entity_ids:
+            likes, likers, ratings, rating_sum, *histogram = rows.get(entity_id, (0,) * (4 + RATING_MAX))
+            aggregates[entity_id] = {
+                'likes': likes,
+                'likers': likers,
+                'ratings': ratings,
+                'average': rating_sum / ratings if ratings else None,
+                'histogram': histogram
+            }
+        return aggregates
+
+    def get(self, entity_type, entity_id):
+        return self.get_many(entity_type, [entity_id])[entity_id]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_aggregate_store():
+    """
+    Returns the process-wide aggregate store, opened from Config.SOCIAL_DB on first use.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = AggregateStore(Config.SOCIAL_DB)
+    return _store
@@ -1,20 +1,29 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session
-import requests
-import tensorflow as tf
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, stream_template
 import numpy as np
 import os
 import json
 from collections import defaultdict, Counter
 from config import Config
-from routes import user_routes, playlist_routes, recommendation_routes, group_routes
+import time
+from similarity_store import SimilarityStore
+from comment_store import get_comment_store
+from aggregate_store import get_aggregate_store
+from group_store import get_group_store
+from spotify_client import SpotifyError, get_client
+from async_spotify import get_async_client, use_async_views
+from model_bundle import BundleHolder, Retrainer, load_artifact, open_vocabulary
+from lsh import MinHashLSH
+from playlists import get_playlist_fetcher
+from user_matrix import named_features, top_k
+from profile_store import get_profile_store
+from routes import playlist_routes, recommendation_routes, group_routes
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "default_secret_key")  # Use a default value if the key is not found
 app.config.from_object(Config)
-app.register_blueprint(user_routes, url_prefix='/user')
 app.register_blueprint(playlist_routes, url_prefix='/playlist')
 app.register_blueprint(recommendation_routes, url_prefix='/recommend')
 app.register_blueprint(group_routes, url_prefix='/group')
@@ -38,21 +47,13 @@ auth_query_parameters = {
     "client_id": SPOTIPY_CLIENT_ID
 }
 
-# Load user data from JSON files
-def load_user_data():
-    users_data = {}
-    for filename in os.listdir('data'):
-        if filename.endswith('.json'):
-            with open(os.path.join('data', filename)) as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    for user in data:
-                        users_data[user['username']] = user
-                elif isinstance(data, dict):
-                    users_data[data['username']] = data
-    return users_data
-
-users_data = load_user_data()
+users_data = get_profile_store()
+spotify = get_client()
+
+@app.errorhandler(SpotifyError)
+def spotify_error(e):
+    app.logger.warning("%s", e)
+    return e.message, e.status or 502
 
 # In-memory store for following relationships and messages
 following = {}
@@ -71,7 +72,7 @@ def login():
 @app.route('/callback')
 def callback():
     auth_token = request.args['code']
-    auth_response = requests.post(SPOTIFY_TOKEN_URL, data={
+    auth_response = spotify.request('POST', SPOTIFY_TOKEN_URL, data={
         'grant_type': 'authorization_code',
         'code': auth_token,
         'redirect_uri': SPOTIPY_REDIRECT_URI,
@@ -81,11 +82,7 @@ def callback():
 
     session['token_info'] = auth_response
 
-    headers = {
-        'Authorization': f"Bearer {auth_response['access_token']}"
-    }
-
-    user_profile = requests.get('https://api.spotify.com/v1/me', headers=headers).json()
+    user_profile = spotify.get('me', auth_response['access_token'])
     session['user_id'] = user_profile['id']
 
     return redirect(url_for('dashboard'))
@@ -96,16 +93,16 @@ def dashboard():
     if not token_info:
         return redirect(url_for('index'))
 
-    headers = {
-        'Authorization': f"Bearer {token_info['access_token']}"
-    }
+    # The three calls are independent, so the page waits for the slowest one
+    # rather than for all of them in turn
+    user_profile, top_artists, top_songs = spotify.get_all(
+        ['me', 'me/top/artists', 'me/top/tracks'], token_info['access_token']
+    )
+    return render_dashboard(user_profile, top_artists, top_songs)
 
-    user_profile = requests.get('https://api.spotify.com/v1/me', headers=headers).json()
+def render_dashboard(user_profile, top_artists, top_songs):
     username = user_profile['id']
 
-    top_artists = requests.get('https://api.spotify.com/v1/me/top/artists', headers=headers).json()
-    top_songs = requests.get('https://api.spotify.com/v1/me/top/tracks', headers=headers).json()
-    
     user_data = {
         'username': username,
         'top_artists': [artist['name'] for artist in top_artists['items']],
@@ -113,15 +110,32 @@ def dashboard():
         'genres': list(set([genre for artist in top_artists['items'] for genre in artist['genres']]))
     }
 
+    is_new_user = username not in users_data
+    profile_changed = users_data.get(username) != user_data
     users_data[username] = user_data
-
-    if username in similarities:
-        similar_users = similarities[username]
-    else:
-        similar_users = find_similar_users(user_data, username, artist_to_index, song_to_index, genre_to_index)
-        update_similarities(username, similar_users)
-
-    return render_template('dashboard.html', user_data=user_data, similar_users=similar_users, enumerate=enumerate)
+    bundle = similarity_bundles.upsert(username, user_data)
+    if is_new_user and retrainer is not None:
+        retrainer.notify_new_user()
+    if lsh_index is not None:
+        lsh_index.insert(username, user_data)
+
+    stamp = similarity_stamp(bundle)
+    similar_users = similarity_store.get(username, stamp)
+    if similar_users is None:
+        similar_users = find_similar_users(user_data, username, bundle)
+        threshold = similarity_store.put(username, similar_users, stamp)
+        if stamp == 'cosine':
+            bundle.user_matrix.set_thresholds([(username, matrix_threshold(threshold))])
+    if stamp == 'cosine' and profile_changed:
+        update_reverse_neighbours(username, user_data, bundle)
+    # Keeps the taste of the user's groups in step with their profile; a no-op
+    # when the stored vector is already current
+    group_store.update_features(username, named_features(user_data))
+
+    # One batched lookup scores every listed artist
+    artist_scores = aggregate_store.get_many('artist', user_data['top_artists'])
+    return render_template('dashboard.html', user_data=user_data, similar_users=similar_users, enumerate=enumerate,
+                           artist_scores=artist_scores)
 
 @app.route('/top_artists')
 def top_artists():
@@ -133,11 +147,7 @@ def top_artists():
     if not token_info:
         return redirect(url_for('index'))
 
-    headers = {
-        'Authorization': f"Bearer {token_info['access_token']}"
-    }
-
-    top_artists = requests.get('https://api.spotify.com/v1/me/top/artists', headers=headers).json()
+    top_artists = spotify.get('me/top/artists', token_info['access_token'])
     
     return render_template('top_artists.html', top_artists=top_artists)
 
@@ -206,119 +216,94 @@ def user_stats(username):
     is_following = username in following.get(current_user, set())
     return render_template('user_stats.html', user_data=user_data, is_following=is_following)
 
-def build_similarity_model(input_dim):
-    model = tf.keras.Sequential([
-        tf.keras.layers.Dense(128, activation='relu', input_shape=(input_dim,)),
-        tf.keras.layers.Dense(64, activation='relu'),
-        tf.keras.layers.Dense(1, activation='sigmoid')  # Output a similarity score between 0 and 1
-    ])
-    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
-    return model
-
-def create_mappings(users_data):
-    all_artists = set()
-    all_songs = set()
-    all_genres = set()
-
-    for user_data in users_data.values():
-        all_artists.update(user_data['top_artists'])
-        all_songs.update(user_data['top_songs'])
-        all_genres.update(user_data['genres'])
-
-    artist_to_index = {artist: idx for idx, artist in enumerate(all_artists)}
-    song_to_index = {song: idx for idx, song in enumerate(all_songs)}
-    genre_to_index = {genre: idx for idx, genre in enumerate(all_genres)}
-
-    return artist_to_index, song_to_index, genre_to_index
-
-def create_vector(data, artist_to_index, song_to_index, genre_to_index):
-    artist_vector = np.zeros(len(artist_to_index))
-    song_vector = np.zeros(len(song_to_index))
-    genre_vector = np.zeros(len(genre_to_index))
-
-    for artist in data['top_artists']:
-        if artist in artist_to_index:
-            artist_vector[artist_to_index[artist]] = 1
-    
-    for song in data['top_songs']:
-        if song in song_to_index:
-            song_vector[song_to_index[song]] = 1
-
-    for genre in data['genres']:
-        if genre in genre_to_index:
-            genre_vector[genre_to_index[genre]] = 1
-
-    return np.concatenate([artist_vector, song_vector, genre_vector])
-
-def train_similarity_model(users_data, artist_to_index, song_to_index, genre_to_index):
-    user_vectors = []
-    labels = []
-
-    usernames = list(users_data.keys())
-    for i in range(len(usernames)):
-        for j in range(i + 1, len(usernames)):
-            user_vector_i = create_vector(users_data[usernames[i]], artist_to_index, song_to_index, genre_to_index)
-            user_vector_j = create_vector(users_data[usernames[j]], artist_to_index, song_to_index, genre_to_index)
-            combined_vector = np.abs(user_vector_i - user_vector_j)
-            user_vectors.append(combined_vector)
-            labels.append(1 if combined_vector.sum() == 0 else 0)  # Simple label assignment for similar and different users
-
-    user_vectors = np.array(user_vectors)
-    labels = np.array(labels)
-
-    model = build_similarity_model(user_vectors.shape[1])
-    model.fit(user_vectors, labels, epochs=10, batch_size=32)  # Adjust epochs and batch_size as needed
-
-    return model
-from sklearn.metrics.pairwise import cosine_similarity
-
-def calculate_similarity(vector1, vector2):
-    return cosine_similarity([vector1], [vector2])[0][0]
-
-def find_similar_users(user_data, current_username, artist_to_index, song_to_index, genre_to_index):
-    user_vector = create_vector(user_data, artist_to_index, song_to_index, genre_to_index)
-    similarities = {}
-
-    for username, data in users_data.items():
-        if username == current_username:
-            continue
-        data_vector = create_vector(data, artist_to_index, song_to_index, genre_to_index)
-        similarity = calculate_similarity(user_vector, data_vector)
-        similarities[username] = similarity
-
-    sorted_users = sorted(similarities.items(), key=lambda x: x[1], reverse=True)
-    return [(user, sim * 100) for user, sim in sorted_users][:10]
-
-import pickle
-def save_similarities(similarities, filename='similarities.pkl'):
-    with open(filename, 'wb') as f:
-        pickle.dump(similarities, f)
-
-def load_similarities(filename='similarities.pkl'):
-    if os.path.exists(filename):
-        with open(filename, 'rb') as f:
-            return pickle.load(f)
-    return {}
-
-similarities = load_similarities()
-
-def update_similarities(username, similar_users):
-    similarities[username] = similar_users
-    save_similarities(similarities)
-
-# Add this global flag
-model_loaded = False
-
-@app.before_request
-def load_model():
-    global artist_to_index, song_to_index, genre_to_index, model, model_loaded
-    if not model_loaded:
-        artist_to_index, song_to_index, genre_to_index = create_mappings(users_data)
-        model = train_similarity_model(users_data, artist_to_index, song_to_index, genre_to_index)
-        model_loaded = True
-
-# In-memory store for comments
-comments = defaultdict(lambda: defaultdict(list))  # {username: {entity_id: [comments]}}
+def find_similar_users(user_data, current_username, bundle):
+    started = time.perf_counter()
+    candidates = None
+    if lsh_index is not None:
+        # Rerank only the users sharing an LSH bucket; fall back to the full
+        # scan for profiles with no bucket neighbours at all.
+        candidates = lsh_index.candidates(user_data, exclude=current_username) or None
+
+    # With model ranking, cosine only shortlists candidates and the model
+    # scores all of their pair vectors in one batched predict
+    use_model = app.config['SIMILAR_USERS_RANKING'] == 'model' and bundle.model is not None
+    k = app.config['RERANK_CANDIDATES'] if use_model else 10
+    user_matrix = bundle.user_matrix
+    similar_users = user_matrix.most_similar(user_data, k=k, exclude=current_username, candidates=candidates)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if use_model and similar_users:
+        if elapsed_ms < app.config['RERANK_BUDGET_MS']:
+            usernames = [user for user, _ in similar_users]
+            scores = bundle.model.predict(user_matrix.pair_vectors(user_data, usernames, bundle.model.input_dim))
+            similar_users = [(usernames[i], float(scores[i])) for i in top_k(scores, 10)]
+        else:
+            app.logger.info("Skipped model rerank: candidate generation took %.1f ms", elapsed_ms)
+
+    return [(user, sim * 100) for user, sim in similar_users[:10]]
+
+def similarity_stamp(bundle):
+    # Cached lists are only valid for the ranking (and model) that produced them
+    if app.config['SIMILAR_USERS_RANKING'] == 'model' and bundle.model is not None:
+        return f"model:{bundle.version}"
+    return 'cosine'
+
+def matrix_threshold(threshold):
+    # Cached lists hold similarity * 100; the user matrix compares raw cosine.
+    # None means the user has no list to maintain.
+    return np.inf if threshold is None else threshold / 100
+
+def update_reverse_neighbours(username, user_data, bundle):
+    # Existing users' cosine lists only change if the new or changed profile
+    # beats their threshold; one scores pass over the matrix finds them and
+    # only those lists are rewritten.
+    owners = bundle.user_matrix.reverse_neighbours(user_data, exclude=username)
+    if owners:
+        thresholds = similarity_store.add_neighbour(username, [(owner, sim * 100) for owner, sim in owners], 'cosine')
+        bundle.user_matrix.set_thresholds((owner, matrix_threshold(threshold)) for owner, threshold in thresholds)
+
+similarity_store = SimilarityStore(app.config['SIMILARITIES_DB'], ttl=app.config['SIMILARITIES_TTL'])
+
+lsh_index = None
+if app.config['SIMILAR_USERS_INDEX'] == 'lsh':
+    lsh_index = MinHashLSH(app.config['LSH_NUM_PERM'], app.config['LSH_BANDS'])
+    lsh_index.extend(list(users_data.items()))
+
+# Loading the artifact only reads the exported weights, so it is done at boot;
+# without a usable artifact the app serves cosine similarity only.
+vocabulary = open_vocabulary(app.config['VOCABULARY_PATH'], app.config['MODEL_PATH'])
+similarity_bundles = BundleHolder(vocabulary, users_data)
+# Blueprints reach the user matrix (for group tastes) through here
+app.extensions['similarity_bundles'] = similarity_bundles
+similarity_bundles.current.user_matrix.set_thresholds(
+    (username, matrix_threshold(threshold)) for username, threshold in similarity_store.thresholds('cosine')
+)
+
+def load_similarity_model():
+    try:
+        model, entries, version = load_artifact(app.config['MODEL_PATH'])
+        similarity_bundles.swap(model, entries, version)
+    except (OSError, ValueError) as e:
+        app.logger.warning("Similarity model not loaded: %s", e)
+        return
+    app.logger.info("Loaded similarity model version %s", version)
+
+load_similarity_model()
+
+retrainer = None
+if app.config['RETRAIN_INTERVAL'] or app.config['RETRAIN_AFTER_NEW_USERS']:
+    retrainer = Retrainer(
+        similarity_bundles,
+        users_data,
+        app.config['MODEL_PATH'],
+        interval=app.config['RETRAIN_INTERVAL'],
+        min_new_users=app.config['RETRAIN_AFTER_NEW_USERS'],
+        train_args=['--pairs-per-epoch', str(app.config['TRAIN_PAIRS_PER_EPOCH'])]
+    )
+    retrainer.start()
+
+comment_store = get_comment_store()
+group_store = get_group_store()
 
 @app.route('/comment/<entity_type>/<entity_id>', methods=['GET', 'POST'])
 def comment(entity_type, entity_id):
@@ -328,11 +313,7 @@ def comment(entity_type, entity_id):
     
     if request.method == 'POST':
         comment_content = request.form['comment']
-        comments[current_user][entity_id].append({
-            'from': current_user,
-            'content': comment_content,
-            'entity_type': entity_type
-        })
+        comment_store.add(entity_type, entity_id, current_user, comment_content)
         return redirect(url_for('view_entity', entity_type=entity_type, entity_id=entity_id))
     
     return render_template('comment.html', entity_type=entity_type, entity_id=entity_id)
@@ -343,14 +324,14 @@ def view_entity(entity_type, entity_id):
     if not current_user:
         return redirect(url_for('index'))
     
-    entity_comments = []
-    for user, entities in comments.items():
-        entity_comments.extend(entities.get(entity_id, []))
-    
-    return render_template('view_entity.html', entity_type=entity_type, entity_id=entity_id, comments=entity_comments)
+    entity_comments, older = comment_store.page(
+        entity_type, entity_id, app.config['COMMENTS_PAGE_SIZE'], request.args.get('before', type=int)
+    )
+    return render_template('view_entity.html', entity_type=entity_type, entity_id=entity_id, comments=entity_comments,
+                           comment_count=comment_store.count(entity_type, entity_id), older=older,
+                           aggregates=aggregate_store.get(entity_type, entity_id))
 
-# In-memory store for likes
-likes = defaultdict(lambda: defaultdict(int))  # {entity_id: {username: count}}
+aggregate_store = get_aggregate_store()
 
 @app.route('/like/<entity_type>/<entity_id>')
 def like(entity_type, entity_id):
@@ -358,12 +339,9 @@ def like(entity_type, entity_id):
     if not current_user:
         return redirect(url_for('index'))
 
-    likes[entity_id][current_user] += 1
+    aggregate_store.like(entity_type, entity_id, current_user)
     return redirect(url_for('view_entity', entity_type=entity_type, entity_id=entity_id))
 
-# In-memory store for ratings
-ratings = defaultdict(lambda: defaultdict(list))  # {entity_id: {username: [ratings]}}
-
 @app.route('/rate/<entity_type>/<entity_id>', methods=['GET', 'POST'])
 def rate(entity_type, entity_id):
     current_user = session.get('user_id')
@@ -373,10 +351,30 @@ def rate(entity_type, entity_id):
     if request.method == 'POST':
         rating = int(request.form['rating'])
         if 1 <= rating <= 5:
-            ratings[entity_id][current_user].append(rating)
+            aggregate_store.rate(entity_type, entity_id, current_user, rating)
         return redirect(url_for('view_entity', entity_type=entity_type, entity_id=entity_id))
     
     return render_template('rate.html', entity_type=entity_type, entity_id=entity_id)
+
+# Upper bound on the entity ids one /aggregates call may ask for
+MAX_AGGREGATE_IDS = 500
+
+# Like and rating aggregates of many entities in one call; the ids come as
+# repeated `id` query parameters or as a JSON body {"ids": [...]}
+@app.route('/aggregates/<entity_type>', methods=['GET', 'POST'])
+def aggregates(entity_type):
+    current_user = session.get('user_id')
+    if not current_user:
+        return redirect(url_for('index'))
+
+    payload = request.get_json(silent=True)
+    entity_ids = payload.get('ids', []) if isinstance(payload, dict) else request.args.getlist('id')
+    if not isinstance(entity_ids, list) or not entity_ids or \
+            not all(isinstance(entity_id, str) for entity_id in entity_ids):
+        return jsonify({'error': 'Expected a list of entity ids'}), 400
+    if len(entity_ids) > MAX_AGGREGATE_IDS:
+        return jsonify({'error': f'At most {MAX_AGGREGATE_IDS} entity ids per call'}), 400
+    return jsonify(aggregate_store.get_many(entity_type, entity_ids))
 @app.route('/create_playlist')
 def create_playlist():
     current_user = session.get('user_id')
@@ -431,13 +429,45 @@ def view_playlist(playlist_id):
     if not token_info:
         return redirect(url_for('index'))
 
-    headers = {
-        'Authorization': f"Bearer {token_info['access_token']}"
-    }
+    # Tracks are rendered as their pages arrive
+    playlist, tracks = get_playlist_fetcher().open(playlist_id, token_info['access_token'])
+
+    return stream_template('view_playlist.html', playlist=playlist, tracks=tracks)
+
+# Async variants of the Spotify-bound views, served instead of the ones above
+# when SPOTIFY_ASYNC is set. view_playlist streams its response, which Flask
+# async views cannot do, so it stays sync.
+async def dashboard_async():
+    token_info = session.get('token_info')
+    if not token_info:
+        return redirect(url_for('index'))
+
+    spotify_async = get_async_client()
+    user_profile, top_artists, top_songs = await spotify_async.run(
+        spotify_async.get_all(['me', 'me/top/artists', 'me/top/tracks'], token_info['access_token'])
+    )
+    return render_dashboard(user_profile, top_artists, top_songs)
+
+async def top_artists_async():
+    current_user = session.get('user_id')
+    token_info = session.get('token_info')
+    if not current_user or not token_info:
+        return redirect(url_for('index'))
+
+    spotify_async = get_async_client()
+    top_artists = await spotify_async.run(spotify_async.get('me/top/artists', token_info['access_token']))
+    return render_template('top_artists.html', top_artists=top_artists)
 
-    playlist = requests.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', headers=headers).json()
+if app.config['SPOTIFY_ASYNC']:
+    from routes.playlist_routes import async_views as playlist_async_views
+    from routes.recommendation_routes import async_views as recommendation_async_views
 
-    return render_template('view_playlist.html', playlist=playlist)
+    use_async_views(app, {
+        'dashboard': dashboard_async,
+        'top_artists': top_artists_async
+    })
+    use_async_views(app, recommendation_async_views)
+    use_async_views(app, playlist_async_views)
 
 
 if __name__ == '__main__':
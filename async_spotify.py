@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import threading
+
+try:
+    import httpx
+except ImportError:  # only needed when SPOTIFY_ASYNC is set
+    httpx = None
+
+# Connections per httpx client. httpcore checks every pooled connection for
+# every queued request, which gets quadratic past a few dozen connections, so
+# the pool is split across several small clients used in turn.
+_CONNECTIONS_PER_CLIENT = 8
+
+from spotify_client import SpotifyError, get_client, recommendation_query
+
+
+class AsyncSpotifyClient:
+    """
+    asyncio counterpart of SpotifyClient, built on one shared httpx.AsyncClient.
+
+    The httpx clients live on a dedicated event loop in a background thread,
+    so their bounded connection pool is shared by every request, whichever
+    thread or event loop it is served on: async code awaits run(coro), sync
+    code calls call(coro). Settings, the retry policy and the caches come from
+    the given SpotifyClient, so sync and async views share the same cached
+    profiles, top items and recommendations.
+    """
+
+    def __init__(self, client):
+        if httpx is None:
+            raise RuntimeError('The async Spotify client needs httpx: pip install "flask[async]" httpx')
+        self.client = client
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='spotify-async', daemon=True)
+        self._thread.start()
+        self._flights = {}  # {recommendation key: asyncio.Task}, only touched on self.loop
+        self._http = itertools.cycle(self.call(self._open()))
+
+    async def _open(self):
+        connect_timeout, read_timeout = self.client.timeout
+        n_clients = -(-self.client.pool_size // _CONNECTIONS_PER_CLIENT)
+        size = -(-self.client.pool_size // n_clients)
+        return [
+            httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+            )
+            for _ in range(n_clients)
+        ]
+
+    def call(self, coro):
+        """
+        Runs a coroutine on the client's loop and blocks for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def run(self, coro):
+        """
+        Runs a coroutine on the client's loop and awaits its result from any other loop.
+        """
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def request(self, method, path, token=None, headers=None, **kwargs):
+        """
+        Sends a request and returns the successful httpx.Response.
+
+        Raises:
+            SpotifyError: If the call still fails after the allowed retries.
+        """
+        method = method.upper()
+        headers = dict(headers or {})
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        url = self.client._url(path)
+
+        attempt = 0
+        while True:
+            try:
+                response = await next(self._http).request(method, url, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                sent = not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                delay = self.client._retry_delay(method, attempt, sent=sent)
+                if delay is None:
+                    raise SpotifyError(f"Request to Spotify failed: {e!r}") from e
+            else:
+                if response.status_code < 400:
+                    return response
+                delay = self.client._retry_delay(method, attempt, response)
+                if delay is None:
+                    raise SpotifyError.from_response(response)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, path, token=None, params=None):
+        ttl = self.client.cache_ttls.get(path)
+        if ttl and token and not params:
+            return await self._cached_get(path, token, ttl)
+        return self.client._json(await self.request('GET', path, token, params=params))
+
+    async def _cached_get(self, path, token, ttl):
+        key = (token, path)
+        entry = self.client.cache.get(key)
+        state = self.client._cache_state(entry)
+        if state == 'stale' and self.client._start_refresh(key):
+            asyncio.ensure_future(self._refresh(key, entry, ttl))
+        if state is not None:
+            return entry.body
+        return await self._revalidate(key, entry, ttl)
+
+    async def _revalidate(self, key, entry, ttl):
+        token, path = key
+        headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else None
+        response = await self.request('GET', path, token, headers=headers)
+        if response.status_code == 304:
+            body = entry.body
+        else:
+            body = self.client._json(response)
+        self.client.cache.put(key, body, response.headers.get('ETag', entry.etag if entry else None), ttl)
+        return body
+
+    async def _refresh(self, key, entry, ttl):
+        try:
+            await self._revalidate(key, entry, ttl)
+        except SpotifyError:
+            pass  # keep serving the stale entry until a refresh succeeds
+        finally:
+            self.client._end_refresh(key)
+
+    async def post(self, path, token=None, json=None):
+        return self.client._json(await self.request('POST', path, token, json=json))
+
+    async def delete(self, path, token=None, json=None):
+        return self.client._json(await self.request('DELETE', path, token, json=json))
+
+    async def get_all(self, paths, token=None):
+        """
+        GETs several paths concurrently and returns their JSON bodies in order.
+
+        Raises:
+            SpotifyError: The error of the first failed path, once every call has finished.
+        """
+        results = await asyncio.gather(*(self.get(path, token) for path in paths), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def recommendations(self, token, seed_artists=None, seed_tracks=None, seed_genres=None, limit=10):
+        """
+        Returns /recommendations for a seed set, from the shared cache when
+        possible; concurrent identical requests share one upstream call.
+        """
+        key, params = recommendation_query(seed_artists, seed_tracks, seed_genres, limit)
+        cache = self.client._recommendations
+        entry = cache.get(key)
+        if entry is not None and self.client._cache_state(entry) == 'fresh':
+            return entry.body
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(self._fetch_recommendations(key, token, params))
+        return await asyncio.shield(flight)
+
+    async def _fetch_recommendations(self, key, token, params):
+        try:
+            body = await self.get('recommendations', token, params=params)
+            if self.client.recommendations_ttl:
+                self.client._recommendations.put(key, body, ttl=self.client.recommendations_ttl)
+            return body
+        finally:
+            del self._flights[key]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_async_client():
+    """
+    Returns the process-wide async client, sharing get_client()'s settings and caches.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AsyncSpotifyClient(get_client())
+    return _client
+
+
+def use_async_views(app, views):
+    """
+    Serves the given {endpoint: async view} instead of the registered views.
+
+    Endpoints the app has not registered are left alone.
+    """
+    for endpoint, view in views.items():
+        if endpoint in app.view_functions:
+            app.view_functions[endpoint] = view
@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from config import Config
+from similarity_store import SimilarityStore
+from user_matrix import UserMatrix
+from utils import load_user_data
+from vocabulary import Vocabulary
+
+# Bytes of working memory per score at the peak of _block_neighbours: the
+# float32 scores, their negated float32 copy and argpartition's int64 indices
+_BYTES_PER_SCORE = 16
+
+# Matrix shared by the pool, set once per worker process by _init_worker
+_worker = {}
+
+
+def _init_worker(matrix, usernames, k):
+    _worker.update(matrix=matrix, matrix_t=matrix.T.tocsr(), usernames=usernames, k=k)
+
+
+def _block_neighbours(start, stop):
+    """
+    Returns (start, stop, [(username, neighbours)]) for matrix rows start:stop.
+    """
+    matrix, usernames, k = _worker['matrix'], _worker['usernames'], _worker['k']
+    scores = (matrix[start:stop] @ _worker['matrix_t']).toarray()
+    rows = np.arange(stop - start)
+    scores[rows, rows + start] = -np.inf  # nobody is their own neighbour
+
+    k = min(k, scores.shape[1] - 1)
+    if k <= 0:
+        return start, stop, [(username, []) for username in usernames[start:stop]]
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    results = []
+    for row in rows:
+        neighbours = [(usernames[i], float(sim) * 100) for i, sim in zip(top[row], top_scores[row])]
+        results.append((usernames[start + row], neighbours))
+    return start, stop, results
+
+
+def block_rows(n_users, matrix_bytes, memory_mb, workers):
+    """
+    Returns how many rows each worker can score at once within memory_mb.
+
+    Every worker holds its own copy of the matrix (and its transpose) plus a
+    dense block of scores against all n_users.
+    """
+    budget = memory_mb * 2 ** 20 / workers - 2 * matrix_bytes
+    if budget <= 0:
+        raise ValueError(f"{memory_mb} MB cannot hold {workers} copies of the user matrix; "
+                         f"lower --workers or raise --memory-mb")
+    return int(max(1, min(n_users, budget // (n_users * _BYTES_PER_SCORE))))
+
+
+class BatchProgress:
+    """
+    Row ranges already written by a batch run, kept next to the similarity store.
+
+    A run is identified by its users, their feature rows and k, so rerunning
+    the same job after a crash skips finished rows, while a run over changed
+    data starts over. A run that completes clears its progress, so the next
+    one (e.g. the following night) recomputes every list.
+    """
+
+    def __init__(self, path, run):
+        self.run = run
+        self._conn = sqlite3.connect(path, timeout=30)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_progress ("
+                " run TEXT NOT NULL, start INTEGER NOT NULL, stop INTEGER NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM batch_progress WHERE run != ?", (run,))
+
+    def reset(self):
+        with self._conn:
+            self._conn.execute("DELETE FROM batch_progress")
+
+    def pending(self, n_rows, size):
+        """
+        Returns the (start, stop) blocks of at most `size` rows still to do.
+        """
+        todo = np.ones(n_rows, dtype=bool)
+        for start, stop in self._conn.execute("SELECT start, stop FROM batch_progress WHERE run = ?", (self.run,)):
+            todo[start:stop] = False
+
+        # Edges of the runs of rows still to do, as (first, past-the-end) pairs
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], todo, [False])).astype(np.int8)))
+        blocks = []
+        for first, end in edges.reshape(-1, 2).tolist():
+            blocks.extend((start, min(start + size, end)) for start in range(first, end, size))
+        return blocks
+
+    def mark(self, start, stop):
+        with self._conn:
+            self._conn.execute("INSERT INTO batch_progress (run, start, stop) VALUES (?, ?, ?)",
+                               (self.run, start, stop))
+
+
+def run_id(usernames, matrix, k):
+    digest = hashlib.sha1(str(k).encode('utf-8'))
+    for username in usernames:
+        digest.update(b'\0' + username.encode('utf-8'))
+    # The rows cover both the profiles and the vocabulary ids they map to
+    for array in (matrix.indptr, matrix.indices, matrix.data):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def precompute_similarities(users_data, vocabulary, store, k=10, workers=None, memory_mb=1024, restart=False):
+    """
+    Computes every user's top-k cosine neighbours and writes them to the store.
+
+    The user matrix is split into row blocks; each block is multiplied by the
+    transposed matrix in a process pool, the top k of each row kept, and the
+    lists written as soon as a block finishes. Finished blocks are recorded so
+    an interrupted run resumes where it stopped.
+
+    Args:
+        users_data (dict): Profiles keyed by username.
+        vocabulary (Vocabulary): Feature vocabulary shared with the app.
+        store (SimilarityStore): Where the lists are written, stamped 'cosine'.
+        k (int, optional): Neighbours per user. Defaults to 10.
+        workers (int, optional): Worker processes. Defaults to the CPU count.
+        memory_mb (int, optional): Memory ceiling for all workers together. Defaults to 1024.
+        restart (bool, optional): Ignore the progress of an earlier run. Defaults to False.
+
+    Returns:
+        int: Number of users written by this run.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Sorted, so a resumed run sees the same row order
+    users_data = dict(sorted(users_data.items()))
+    matrix, _, usernames = UserMatrix.from_users(users_data, vocabulary).snapshot()
+    usernames = list(usernames)
+    matrix_bytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    size = block_rows(len(usernames), matrix_bytes, memory_mb, workers)
+
+    progress = BatchProgress(store.path, run_id(usernames, matrix, k))
+    if restart:
+        progress.reset()
+    blocks = progress.pending(len(usernames), size)
+    total = sum(stop - start for start, stop in blocks)
+    print(f"{len(usernames)} users, {total} to do in {len(blocks)} blocks of up to {size} rows, {workers} workers")
+
+    written = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(matrix, usernames, k)) as pool:
+        # Keep only a few blocks in flight so finished results are written
+        # (and their memory released) while the rest are still computing
+        queued = iter(blocks)
+        running = set()
+        while True:
+            for start, stop in queued:
+                running.add(pool.submit(_block_neighbours, start, stop))
+                if len(running) >= 2 * workers:
+                    break
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                start, stop, results = future.result()
+                store.put_many(results, 'cosine')
+                progress.mark(start, stop)
+                written += stop - start
+            elapsed = time.perf_counter() - started
+            print(f"\r{written}/{total} users, {written / max(elapsed, 1e-9):.0f} users/s", end='', flush=True)
+    print()
+    # Only an interrupted run resumes; the next full run starts over
+    progress.reset()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute every user's similar-user list into the similarity store.")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--vocabulary', default=Config.VOCABULARY_PATH)
+    parser.add_argument('--db', default=Config.SIMILARITIES_DB)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=Config.BATCH_WORKERS)
+    parser.add_argument('--memory-mb', type=int, default=Config.BATCH_MEMORY_MB)
+    parser.add_argument('--restart', action='store_true', help="discard the progress of an interrupted run")
+    args = parser.parse_args()
+
+    store = SimilarityStore(args.db, ttl=Config.SIMILARITIES_TTL, k=args.k)
+    written = precompute_similarities(load_user_data(args.data_dir), Vocabulary(args.vocabulary), store,
+                                      args.k, args.workers, args.memory_mb, args.restart)
+    print(f"Wrote {written} similar-user lists to {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+# Canned Spotify payloads served by the stub, keyed by path
+STUB_RESPONSES = {
+    '/v1/me': {'id': 'bench_user'},
+    '/v1/me/top/artists': {'items': [
+        {'id': f'artist{i}', 'name': f'Artist {i}', 'genres': [f'genre{i % 4}']} for i in range(20)
+    ]},
+    '/v1/me/top/tracks': {'items': [{'id': f'track{i}', 'name': f'Track {i}'} for i in range(20)]}
+}
+
+
+def start_stub(latency_ms):
+    """
+    Starts a local Spotify stub answering every GET after latency_ms and returns its base URL.
+
+    The stub runs on its own event loop, so simulated latency costs no threads
+    and the stub itself never becomes the bottleneck.
+    """
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                path = head.split(b' ', 2)[1].decode('utf-8').split('?')[0]
+                await asyncio.sleep(latency_ms / 1000)
+                body = json.dumps(STUB_RESPONSES.get(path, {})).encode('utf-8')
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(asyncio.start_server(handle, '127.0.0.1', 0, backlog=1024))
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}/v1'
+
+
+def serve_and_measure(paths, concurrency, requests_per_path):
+    """
+    Serves the app (configured through the environment) and loads it; returns per-path stats.
+    """
+    from werkzeug.serving import make_server
+    from app import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    cookie = app.session_interface.get_signing_serializer(app).dumps(
+        {'user_id': 'bench_user', 'token_info': {'access_token': 'bench-token'}}
+    )
+
+    local = threading.local()
+
+    def fetch(path):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.cookies.set(app.config['SESSION_COOKIE_NAME'], cookie)
+        started = time.perf_counter()
+        response = local.session.get(base_url + path)
+        elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+        return elapsed
+
+    stats = {}
+    with ThreadPoolExecutor(concurrency) as pool:
+        for path in paths:
+            list(pool.map(fetch, [path] * concurrency))  # warm up connections and caches
+            started = time.perf_counter()
+            latencies = list(pool.map(fetch, [path] * requests_per_path))
+            wall = time.perf_counter() - started
+            stats[path] = {
+                'rps': requests_per_path / wall,
+                'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+                'p95_ms': float(np.percentile(latencies, 95)) * 1000
+            }
+    server.shutdown()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sync versus async Spotify views against a stub with simulated latency.")
+    parser.add_argument('--latency-ms', type=float, default=100)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=256, help="requests per endpoint and mode")
+    parser.add_argument('--paths', nargs='+', default=['/dashboard', '/top_artists'])
+    parser.add_argument('--mode', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        # Child process: the environment already selects the mode
+        print(json.dumps(serve_and_measure(args.paths, args.concurrency, args.requests)))
+        return
+
+    stub_url = start_stub(args.latency_ms)
+    print(f"Upstream latency {args.latency_ms:.0f} ms, {args.concurrency} concurrent clients, "
+          f"{args.requests} requests per endpoint")
+    print(f"{'mode':>6} {'endpoint':<14} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('sync', 'async'):
+            env = dict(
+                os.environ,
+                SPOTIFY_API_URL=stub_url,
+                SPOTIFY_ASYNC='1' if mode == 'async' else '0',
+                SPOTIFY_POOL_SIZE=str(args.concurrency * 3),
+                # Measure upstream calls, not the response cache
+                SPOTIFY_PROFILE_TTL='0',
+                SPOTIFY_TOP_ITEMS_TTL='0',
+                SIMILARITIES_DB=os.path.join(tmp, f'{mode}.db'),
+                SOCIAL_DB=os.path.join(tmp, f'{mode}-social.db'),
+                DATA_SNAPSHOT=os.path.join(tmp, f'{mode}.snapshot'),
+                VOCABULARY_PATH=os.path.join(tmp, f'{mode}.jsonl')
+            )
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--concurrency', str(args.concurrency),
+                 '--requests', str(args.requests), '--paths', *args.paths],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout
+            for path, row in json.loads(output.strip().splitlines()[-1]).items():
+                print(f"{mode:>6} {path:<14} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+import time
+
+from config import Config
+
+
+class CommentStore:
+    """
+    Persistent comments on entities (artists, songs, ...), kept in SQLite.
+
+    Comments are indexed by entity and, secondarily, by author, both in
+    insertion order, so a page of an entity's newest comments is one index
+    range scan whatever the number of comments elsewhere. Pages are keyset
+    paginated: the id of the last comment on a page is the `before` cursor of
+    the next one, so deep pages cost no more than the first. Each entity's
+    comment count is kept in its own table, updated in the same transaction
+    as every insert.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS comments ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " entity_type TEXT NOT NULL,"
+                " entity_id TEXT NOT NULL,"
+                " username TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS comments_by_entity ON comments (entity_type, entity_id, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS comments_by_user ON comments (username, id)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS comment_counts ("
+                " entity_type TEXT NOT NULL,"
+                " entity_id TEXT NOT NULL,"
+                " count INTEGER NOT NULL,"
+                " PRIMARY KEY (entity_type, entity_id))"
+            )
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, entity_type, entity_id, username, content):
+        """
+        Stores a comment and returns its id.
+        """
+        with self._connection() as conn:
+            comment_id = conn.execute(
+                "INSERT INTO comments (entity_type, entity_id, username, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (entity_type, entity_id, username, content, time.time())
+            ).lastrowid
+            conn.execute(
+                "INSERT INTO comment_counts (entity_type, entity_id, count) VALUES (?, ?, 1)"
+                " ON CONFLICT(entity_type, entity_id) DO UPDATE SET count = count + 1",
+                (entity_type, entity_id)
+            )
+        return comment_id
+
+    def _page(self, where, params, limit, before):
+        query = f"SELECT id, entity_type, entity_id, username, content, created_at FROM comments WHERE {where}"
+        if before is not None:
+            query += " AND id < ?"
+            params = params + (before,)
+        # One row past the page tells whether there is a next one
+        rows = self._connection().execute(query + " ORDER BY id DESC LIMIT ?", params + (limit + 1,)).fetchall()
+        comments = [
+            {'id': row['id'], 'from': row['username'], 'content': row['content'],
+             'entity_type': row['entity_type'], 'entity_id': row['entity_id'], 'created_at': row['created_at']}
+            for row in rows[:limit]
+        ]
+        return comments, (comments[-1]['id'] if len(rows) > limit else None)
+
+    def page(self, entity_type, entity_id, limit=20, before=None):
+        """
+        Returns one page of an entity's comments, newest first.
+
+        Args:
+            entity_type (str): Kind of entity, e.g. 'artist'.
+            entity_id (str): The entity.
+            limit (int, optional): Comments per page. Defaults to 20.
+            before (int, optional): Cursor returned with the previous page.
+
+        Returns:
+            tuple: (comments, cursor), the cursor being None on the last page.
+        """
+        return self._page("entity_type = ? AND entity_id = ?", (entity_type, entity_id), limit, before)
+
+    def by_user(self, username, limit=20, before=None):
+        """
+        Returns one page of a user's comments on any entity, newest first, as page() does.
+        """
+        return self._page("username = ?", (username,), limit, before)
+
+    def count(self, entity_type, entity_id):
+        row = self._connection().execute(
+            "SELECT count FROM comment_counts WHERE entity_type = ? AND entity_id = ?", (entity_type, entity_id)
+        ).fetchone()
+        return row['count'] if row is not None else 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_comment_store():
+    """
+    Returns the process-wide comment store, opened from Config.SOCIAL_DB on first use.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CommentStore(Config.SOCIAL_DB)
+    return _store
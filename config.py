@@ -11,3 +11,73 @@ class Config:
     SPOTIFY_AUTH_URL = "https://accounts.spotify.com/authorize"
     SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
     SCOPE = 'user-top-read'
+    # Spotify Web API client: base URL (point it at a stub server for tests),
+    # connections kept per host, timeouts in seconds, and retries of 429/5xx
+    # responses with jittered exponential backoff capped at SPOTIFY_MAX_BACKOFF
+    SPOTIFY_API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+    SPOTIFY_POOL_SIZE = int(os.getenv('SPOTIFY_POOL_SIZE', 20))
+    SPOTIFY_CONNECT_TIMEOUT = float(os.getenv('SPOTIFY_CONNECT_TIMEOUT', 3.05))
+    SPOTIFY_READ_TIMEOUT = float(os.getenv('SPOTIFY_READ_TIMEOUT', 10))
+    SPOTIFY_MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', 3))
+    SPOTIFY_BACKOFF = float(os.getenv('SPOTIFY_BACKOFF', 0.5))
+    SPOTIFY_MAX_BACKOFF = float(os.getenv('SPOTIFY_MAX_BACKOFF', 30))
+    # Serve the Spotify-bound views as async views over a shared httpx client
+    # (needs `pip install "flask[async]" httpx`)
+    SPOTIFY_ASYNC = os.getenv('SPOTIFY_ASYNC', '').lower() in ('1', 'true', 'yes')
+    # Per-user cache of /me and top artists/tracks, in seconds (0 disables),
+    # holding at most SPOTIFY_CACHE_SIZE responses. Expired entries up to
+    # SPOTIFY_STALE_WHILE_REVALIDATE seconds old are served while they refresh.
+    SPOTIFY_PROFILE_TTL = int(os.getenv('SPOTIFY_PROFILE_TTL', 3600))
+    SPOTIFY_TOP_ITEMS_TTL = int(os.getenv('SPOTIFY_TOP_ITEMS_TTL', 3600))
+    SPOTIFY_CACHE_SIZE = int(os.getenv('SPOTIFY_CACHE_SIZE', 1000))
+    SPOTIFY_STALE_WHILE_REVALIDATE = int(os.getenv('SPOTIFY_STALE_WHILE_REVALIDATE', 0))
+    # Playlist pages requested at once when fetching a playlist's tracks, and
+    # the number of complete track lists cached by snapshot_id
+    PLAYLIST_PREFETCH_PAGES = int(os.getenv('PLAYLIST_PREFETCH_PAGES', 4))
+    PLAYLIST_CACHE_SIZE = int(os.getenv('PLAYLIST_CACHE_SIZE', 256))
+    # Recommendations are cached by seed set and limit for this many seconds (0 disables)
+    SPOTIFY_RECOMMENDATIONS_TTL = int(os.getenv('SPOTIFY_RECOMMENDATIONS_TTL', 600))
+
+    # Similar-user lookup: 'exact' scans every user, 'lsh' reranks MinHash/LSH
+    # candidates only. More bands per LSH_NUM_PERM means higher recall and more
+    # candidates per query; see `python lsh.py` for the trade-off on your data.
+    SIMILAR_USERS_INDEX = os.getenv('SIMILAR_USERS_INDEX', 'exact')
+    LSH_NUM_PERM = int(os.getenv('LSH_NUM_PERM', 128))
+    LSH_BANDS = int(os.getenv('LSH_BANDS', 32))
+
+    # 'cosine' ranks similar users by cosine alone; 'model' takes the top
+    # RERANK_CANDIDATES by cosine and reranks them with the trained model,
+    # unless shortlisting already used up RERANK_BUDGET_MS
+    SIMILAR_USERS_RANKING = os.getenv('SIMILAR_USERS_RANKING', 'cosine')
+    RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', 200))
+    RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', 50))
+    # Directory of user profile JSON files loaded at startup
+    DATA_DIR = os.getenv('DATA_DIR', 'data')
+    # Binary snapshot of DATA_DIR, memory-mapped at startup and recompiled when
+    # the JSON files change; empty to parse the JSON on every start
+    DATA_SNAPSHOT = os.getenv('DATA_SNAPSHOT', 'profiles.snapshot')
+    # Processes parsing the files of DATA_DIR in parallel (0 = one per CPU)
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 0))
+    # Cached similar-user lists; entries older than SIMILARITIES_TTL seconds
+    # (0 = never) are recomputed on the next login
+    SIMILARITIES_DB = os.getenv('SIMILARITIES_DB', 'similarities.db')
+    SIMILARITIES_TTL = int(os.getenv('SIMILARITIES_TTL', 86400))
+    # Comments, likes, ratings and groups, and how many comments or group
+    # recommendations a page shows
+    SOCIAL_DB = os.getenv('SOCIAL_DB', 'social.db')
+    COMMENTS_PAGE_SIZE = int(os.getenv('COMMENTS_PAGE_SIZE', 20))
+    GROUP_RECOMMENDATIONS_PAGE_SIZE = int(os.getenv('GROUP_RECOMMENDATIONS_PAGE_SIZE', 20))
+    # Trained model artifact, written by `python training.py` and loaded at startup
+    MODEL_PATH = os.getenv('MODEL_PATH', 'similarity_model.h5')
+    # Append-only artist/song/genre vocabulary shared by the app and training.py
+    VOCABULARY_PATH = os.getenv('VOCABULARY_PATH', 'vocabulary.jsonl')
+    # Number of user pairs sampled per training epoch
+    TRAIN_PAIRS_PER_EPOCH = int(os.getenv('TRAIN_PAIRS_PER_EPOCH', 50000))
+    # Background retraining: every RETRAIN_INTERVAL seconds and/or after
+    # RETRAIN_AFTER_NEW_USERS new users have logged in (0 disables either trigger)
+    RETRAIN_INTERVAL = int(os.getenv('RETRAIN_INTERVAL', 0))
+    RETRAIN_AFTER_NEW_USERS = int(os.getenv('RETRAIN_AFTER_NEW_USERS', 0))
+    # `python batch_similarities.py`: worker processes (0 = one per CPU) and the
+    # memory ceiling they share, which sets how many rows each block scores
+    BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 0))
+    BATCH_MEMORY_MB = int(os.getenv('BATCH_MEMORY_MB', 1024))
@@ -0,0 +1,327 @@
+import json
+import sqlite3
+import threading
+import time
+
+from config import Config
+
+# Taste entries whose sum falls to this are dropped, so members leaving leave no trace
+_EPSILON = 1e-9
+
+
+def _difference(new, old):
+    # {key: new - old} over the keys of either feature dict
+    return {key: new.get(key, 0.0) - old.get(key, 0.0) for key in new.keys() | old.keys()}
+
+
+class GroupStore:
+    """
+    Groups, their members and the recommendations shared in them, in SQLite.
+
+    Membership is one row per (group, member), indexed both ways: by group,
+    and by member as the reverse index behind groups_of(), which therefore
+    costs O(the user's groups) rather than a scan of every group. Joining and
+    leaving insert or delete a single row. Recommendations are paginated in
+    the order they were posted, with the id of the last one on a page as the
+    `after` cursor of the next.
+
+    Being a database file rather than process memory, the groups are the
+    same in every worker process.
+
+    Each group also keeps its taste: the weighted sum of its members' feature
+    vectors (user matrix rows, see user_matrix.named_features()) and their
+    total weight, from which taste() returns the weighted centroid. Features
+    are stored by (kind, name), never by vocabulary id, since ids only hold
+    within one process. Every user's latest vector is stored once; a
+    membership counts towards the taste from the moment its user has one,
+    and then contributes weight x that vector, so joining, leaving and a
+    profile change each touch only the member's own features, however large
+    the group.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS groups ("
+                " name TEXT PRIMARY KEY,"
+                " created_by TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS group_members ("
+                " group_name TEXT NOT NULL,"
+                " username TEXT NOT NULL,"
+                " joined_at REAL NOT NULL,"
+                " PRIMARY KEY (group_name, username)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS group_members_by_user ON group_members (username, group_name)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS group_recommendations ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " group_name TEXT NOT NULL,"
+                " username TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS group_recommendations_by_group ON group_recommendations (group_name, id)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS group_taste ("
+                " group_name TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " value REAL NOT NULL,"
+                " PRIMARY KEY (group_name, kind, name)) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS member_features ("
+                " username TEXT PRIMARY KEY,"
+                " features TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(groups)")]
+            if 'taste_weight' not in columns:
+                conn.execute("ALTER TABLE groups ADD COLUMN taste_weight REAL NOT NULL DEFAULT 0")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(group_members)")]
+            # Existing members count once their features are known
+            if 'weight' not in columns:
+                conn.execute("ALTER TABLE group_members ADD COLUMN weight REAL NOT NULL DEFAULT 1")
+            if 'counted' not in columns:
+                conn.execute("ALTER TABLE group_members ADD COLUMN counted INTEGER NOT NULL DEFAULT 0")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _add_taste(self, conn, name, features, scale, weight):
+        # Adds scale x a feature dict to the group's sum and weight to its total
+        conn.executemany(
+            "INSERT INTO group_taste (group_name, kind, name, value) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT(group_name, kind, name) DO UPDATE SET value = value + excluded.value",
+            [(name, kind, feature, scale * value) for (kind, feature), value in features.items()]
+        )
+        conn.executemany(
+            "DELETE FROM group_taste WHERE group_name = ? AND kind = ? AND name = ? AND abs(value) <= ?",
+            [(name, kind, feature, _EPSILON) for kind, feature in features]
+        )
+        if weight:
+            conn.execute("UPDATE groups SET taste_weight = max(taste_weight + ?, 0) WHERE name = ?", (weight, name))
+
+    def _features(self, conn, username):
+        row = conn.execute("SELECT features FROM member_features WHERE username = ?", (username,)).fetchone()
+        if row is None:
+            return None
+        return {(kind, feature): value for kind, feature, value in json.loads(row[0])}
+
+    def _set_features(self, conn, username, features):
+        # Stores the user's vector and brings every group they are in up to date
+        old = self._features(conn, username)
+        if old == features:
+            return
+        conn.execute(
+            "INSERT INTO member_features (username, features, updated_at) VALUES (?, ?, ?)"
+            " ON CONFLICT(username) DO UPDATE SET features = excluded.features, updated_at = excluded.updated_at",
+            (username, json.dumps([[kind, feature, value] for (kind, feature), value in features.items()]),
+             time.time())
+        )
+        difference = _difference(features, old or {})
+        memberships = conn.execute(
+            "SELECT group_name, weight, counted FROM group_members WHERE username = ?", (username,)
+        ).fetchall()
+        for name, weight, counted in memberships:
+            if counted:
+                self._add_taste(conn, name, difference, weight, 0)
+            else:
+                self._count(conn, name, username, features, weight)
+
+    def _count(self, conn, name, username, features, weight):
+        # Adds a member's contribution to the taste for the first time
+        self._add_taste(conn, name, features, weight, weight)
+        conn.execute("UPDATE group_members SET counted = 1 WHERE group_name = ? AND username = ?", (name, username))
+
+    def _join(self, conn, name, username, features, weight):
+        joined = conn.execute(
+            "INSERT INTO group_members (group_name, username, joined_at, weight, counted) VALUES (?, ?, ?, ?, 0)"
+            " ON CONFLICT(group_name, username) DO NOTHING",
+            (name, username, time.time(), weight)
+        ).rowcount == 1
+        if joined:
+            if features is not None:
+                self._set_features(conn, username, features)
+            # Unless storing new features just counted them, count the member
+            # with the vector stored earlier, if there is one
+            counted = conn.execute(
+                "SELECT counted FROM group_members WHERE group_name = ? AND username = ?", (name, username)
+            ).fetchone()[0]
+            features = self._features(conn, username)
+            if features is not None and not counted:
+                self._count(conn, name, username, features, weight)
+        return joined
+
+    def create(self, name, username, features=None, weight=1.0):
+        """
+        Creates a group with its creator as the first member, joining as join() does.
+
+        Returns:
+            bool: False if a group of that name already exists.
+        """
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            created = conn.execute(
+                "INSERT INTO groups (name, created_by, created_at) VALUES (?, ?, ?) ON CONFLICT(name) DO NOTHING",
+                (name, username, time.time())
+            ).rowcount == 1
+            if created:
+                self._join(conn, name, username, features, weight)
+        return created
+
+    def exists(self, name):
+        return self._connection().execute("SELECT 1 FROM groups WHERE name = ?", (name,)).fetchone() is not None
+
+    def join(self, name, username, features=None, weight=1.0):
+        """
+        Adds a member to an existing group; returns False if they already were one.
+
+        Args:
+            name (str): The group.
+            username (str): The new member.
+            features (dict, optional): The member's current {(kind, name): value}
+                vector. Without it, the last one stored for them is used; a member
+                with none yet counts towards the taste once update_features()
+                brings one.
+            weight (float, optional): The member's weight in the taste. Defaults to 1.
+        """
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            return self._join(conn, name, username, features, weight)
+
+    def leave(self, name, username):
+        """
+        Removes a member, and their contribution to the taste; returns False
+        if they were not a member.
+        """
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT weight, counted FROM group_members WHERE group_name = ? AND username = ?", (name, username)
+            ).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM group_members WHERE group_name = ? AND username = ?", (name, username))
+            weight, counted = row
+            if counted:
+                self._add_taste(conn, name, self._features(conn, username), -weight, -weight)
+        return True
+
+    def update_features(self, username, features):
+        """
+        Stores a user's current {(kind, name): value} vector and updates the
+        taste of every group they are in. Groups they joined before any
+        vector was known start counting them now.
+
+        Called on every dashboard render, so it only takes the write lock
+        when the vector changed and the user is in some group; a user in
+        none gets their vector when they join.
+        """
+        conn = self._connection()
+        if self._features(conn, username) == features:
+            return
+        if conn.execute("SELECT 1 FROM group_members WHERE username = ? LIMIT 1", (username,)).fetchone() is None:
+            return
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._set_features(conn, username, features)
+
+    def taste(self, name):
+        """
+        Returns the group's taste, the weighted centroid of its counted
+        members' vectors, as {(kind, name): value}, or None while no member counts.
+        """
+        conn = self._connection()
+        row = conn.execute("SELECT taste_weight FROM groups WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] <= 0:
+            return None
+        return {
+            (kind, feature): value / row[0]
+            for kind, feature, value in conn.execute(
+                "SELECT kind, name, value FROM group_taste WHERE group_name = ?", (name,)
+            )
+        }
+
+    def is_member(self, name, username):
+        return self._connection().execute(
+            "SELECT 1 FROM group_members WHERE group_name = ? AND username = ?", (name, username)
+        ).fetchone() is not None
+
+    def groups_of(self, username):
+        """
+        Returns the names of the user's groups, in name order.
+        """
+        return [name for (name,) in self._connection().execute(
+            "SELECT group_name FROM group_members WHERE username = ? ORDER BY group_name", (username,)
+        )]
+
+    def members(self, name):
+        return [username for (username,) in self._connection().execute(
+            "SELECT username FROM group_members WHERE group_name = ? ORDER BY joined_at", (name,)
+        )]
+
+    def add_recommendation(self, name, username, content):
+        """
+        Posts a recommendation to a group and returns its id.
+        """
+        with self._connection() as conn:
+            return conn.execute(
+                "INSERT INTO group_recommendations (group_name, username, content, created_at) VALUES (?, ?, ?, ?)",
+                (name, username, content, time.time())
+            ).lastrowid
+
+    def recommendations(self, name, limit=20, after=None):
+        """
+        Returns one page of a group's recommendations, oldest first.
+
+        Args:
+            name (str): The group.
+            limit (int, optional): Recommendations per page. Defaults to 20.
+            after (int, optional): Cursor returned with the previous page.
+
+        Returns:
+            tuple: (recommendations, cursor), the cursor being None on the last page.
+        """
+        query = "SELECT id, username, content, created_at FROM group_recommendations WHERE group_name = ?"
+        params = [name]
+        if after is not None:
+            query += " AND id > ?"
+            params.append(after)
+        # One row past the page tells whether there is a next one
+        rows = self._connection().execute(query + " ORDER BY id LIMIT ?", params + [limit + 1]).fetchall()
+        recommendations = [
+            {'id': row_id, 'from': username, 'content': content, 'created_at': created_at}
+            for row_id, username, content, created_at in rows[:limit]
+        ]
+        return recommendations, (recommendations[-1]['id'] if len(rows) > limit else None)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_group_store():
+    """
+    Returns the process-wide group store, opened from Config.SOCIAL_DB on first use.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = GroupStore(Config.SOCIAL_DB)
+    return _store
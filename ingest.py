@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from profile_store import NAME_FIELDS
+
+logger = logging.getLogger(__name__)
+
+# Characters read from a data file at a time by the streaming parser
+CHUNK_SIZE = 1 << 20
+
+# Below this much JSON, parsing in-process beats starting a worker pool
+_POOL_MIN_BYTES = 8 << 20
+
+_WHITESPACE = ' \t\n\r'
+
+
+def iter_json_array(f, chunk_size=CHUNK_SIZE):
+    """
+    Yields the elements of a JSON array read from a text file, one at a time.
+
+    Only one chunk plus the element being decoded is held in memory, so a
+    multi-GB export never has to fit in memory whole. A file holding a single
+    JSON object rather than an array yields just that object.
+
+    Raises:
+        ValueError: If the file is not valid JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size)
+    pos = 0
+    eof = not buffer
+
+    def skip(pos):
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    pos = skip(pos)
+    while pos == len(buffer) and not eof:
+        buffer = f.read(chunk_size)
+        eof = not buffer
+        pos = skip(0)
+    if buffer[pos:pos + 1] != '[':
+        yield json.loads(buffer[pos:] + f.read())
+        return
+    pos += 1
+
+    first = True
+    expect_separator = False
+    while True:
+        pos = skip(pos)
+        if pos < len(buffer):
+            if expect_separator:
+                if buffer[pos] == ']':
+                    return
+                if buffer[pos] != ',':
+                    raise ValueError("Expected ',' or ']' between JSON array elements")
+                pos += 1
+                expect_separator = False
+                continue
+            if first and buffer[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A scalar may be cut short anywhere (-2500.0 read as -2500.
+                # or -25), so it only counts once the separator after it is in
+                # the buffer; strings and containers end on their own closer
+                after = skip(end)
+                if (buffer[pos] in '"[{' or eof
+                        or after < len(buffer) and buffer[after] in ',]'):
+                    yield element
+                    pos = end
+                    first = False
+                    expect_separator = True
+                    continue
+        elif eof:
+            raise ValueError("JSON array is not terminated")
+
+        more = f.read(chunk_size)
+        eof = not more
+        buffer = buffer[pos:] + more
+        pos = 0
+
+
+def parse_file(path):
+    """
+    Parses one data file into a compact, picklable table of its users.
+
+    Names are interned against a table local to the file; merge_parsed()
+    maps them onto the store's ids.
+
+    Returns:
+        dict: names, usernames, {field: (indptr, indices)}, extras, plus the
+        file's size in bytes and the seconds spent parsing it.
+    """
+    started = time.perf_counter()
+    name_ids = {}
+    usernames = []
+    extras = []
+    fields = {field: (array('q', [0]), array('I')) for field in NAME_FIELDS}
+
+    with open(path, encoding='utf-8') as f:
+        for user in iter_json_array(f):
+            usernames.append(user['username'])
+            for field in NAME_FIELDS:
+                indptr, indices = fields[field]
+                for name in user.get(field, ()):
+                    name_id = name_ids.get(name)
+                    if name_id is None:
+                        name_id = name_ids[name] = len(name_ids)
+                    indices.append(name_id)
+                indptr.append(len(indices))
+            extra = {key: value for key, value in user.items() if key != 'username' and key not in NAME_FIELDS}
+            extras.append(extra or None)
+
+    return {
+        'path': path,
+        'names': list(name_ids),
+        'usernames': usernames,
+        'fields': fields,
+        'extras': extras,
+        'bytes': os.path.getsize(path),
+        'seconds': time.perf_counter() - started
+    }
+
+
+def merge_parsed(store, parsed):
+    """
+    Adds the users of a parse_file() result to a ProfileStore.
+    """
+    remap = np.array(store.intern_all(parsed['names']), dtype=np.uint32)
+    columns = []
+    for field in NAME_FIELDS:
+        indptr, indices = parsed['fields'][field]
+        columns.append((indptr, remap[np.frombuffer(indices, dtype=np.uint32)] if len(indices) else remap[:0]))
+
+    for row, username in enumerate(parsed['usernames']):
+        ids = []
+        for indptr, indices in columns:
+            ids.append(array('I', indices[indptr[row]:indptr[row + 1]].tobytes()))
+        store.put_ids(username, ids, parsed['extras'][row])
+
+
+def ingest(store, data_dir, workers=None):
+    """
+    Loads every .json file in data_dir into a ProfileStore.
+
+    Files are parsed in parallel in a process pool and merged in filename
+    order, so a user found in several files keeps the last file's profile,
+    as before. Progress and per-stage timings are logged.
+
+    Args:
+        store (ProfileStore): Store to add the users to.
+        data_dir (str): Directory of JSON files, each a list of profiles or a single one.
+        workers (int, optional): Parser processes. Defaults to the CPU count;
+            small datasets are parsed in-process.
+    """
+    started = time.perf_counter()
+    paths = [os.path.join(data_dir, filename) for filename in sorted(os.listdir(data_dir)) if filename.endswith('.json')]
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+
+    executor = None
+    if workers > 1 and total_bytes >= _POOL_MIN_BYTES:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        # Largest files first, so one big file does not start last
+        futures = {path: executor.submit(parse_file, path) for path in sorted(paths, key=os.path.getsize, reverse=True)}
+        results = (futures[path].result() for path in paths)
+    else:
+        results = map(parse_file, paths)
+
+    parse_seconds = merge_seconds = 0
+    done_bytes = 0
+    try:
+        for i, parsed in enumerate(results, start=1):
+            merge_started = time.perf_counter()
+            merge_parsed(store, parsed)
+            merge_seconds += time.perf_counter() - merge_started
+            parse_seconds += parsed['seconds']
+            done_bytes += parsed['bytes']
+            logger.info("[%d/%d] %s: %d users, %.1f MB, parsed in %.2f s (%.0f%% of the data, %.1f s elapsed)",
+                        i, len(paths), os.path.basename(parsed['path']), len(parsed['usernames']),
+                        parsed['bytes'] / 2 ** 20, parsed['seconds'], 100 * done_bytes / max(total_bytes, 1),
+                        time.perf_counter() - started)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    mode = f"{workers} worker processes" if executor is not None else "in-process"
+    logger.info("Loaded %d users from %d files (%.1f MB) in %.2f s, %s: "
+                "parsing %.2f s (summed over files), merging %.2f s",
+                len(store), len(paths), total_bytes / 2 ** 20, time.perf_counter() - started, mode,
+                parse_seconds, merge_seconds)
+    return store
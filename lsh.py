@@ -0,0 +1,169 @@
+import argparse
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from user_matrix import UserMatrix
+from vocabulary import Vocabulary
+
+_PRIME = (1 << 31) - 1
+
+
+def user_tokens(data):
+    """
+    Returns the set of tokens MinHash is computed over for one user.
+    """
+    tokens = {f"artist:{artist}" for artist in data['top_artists']}
+    tokens.update(f"song:{song}" for song in data['top_songs'])
+    tokens.update(f"genre:{genre}" for genre in data['genres'])
+    return tokens
+
+
+class MinHashLSH:
+    """
+    Approximate-neighbour index over users' artist/song/genre sets.
+
+    Each user gets a MinHash signature of num_perm values, split into `bands`
+    bands of num_perm // bands rows; users sharing any band land in the same
+    bucket and become candidates for each other. More bands (fewer rows per
+    band) raise recall and the candidate count; fewer bands do the opposite.
+    Two users with Jaccard similarity s become candidates with probability
+    1 - (1 - s ** rows) ** bands.
+    """
+
+    def __init__(self, num_perm=128, bands=32, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)
+
+        self._lock = threading.Lock()
+        self._buckets = [defaultdict(set) for _ in range(bands)]
+        self._keys = {}  # {username: band keys the user is filed under}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def signature(self, tokens):
+        if not tokens:
+            return None
+        hashes = np.fromiter(
+            (zlib.crc32(token.encode('utf-8')) for token in tokens),
+            dtype=np.uint64,
+            count=len(tokens)
+        ) % _PRIME
+        permuted = (hashes[:, None] * self._a + self._b) % _PRIME
+        return permuted.min(axis=0)
+
+    def band_keys(self, data):
+        signature = self.signature(user_tokens(data))
+        if signature is None:
+            return ()
+        return tuple(band.tobytes() for band in signature.reshape(self.bands, self.rows))
+
+    def insert(self, username, data):
+        self.extend([(username, data)])
+
+    def extend(self, items):
+        keyed = [(username, self.band_keys(data)) for username, data in items]
+        with self._lock:
+            for username, keys in keyed:
+                for band, key in enumerate(self._keys.pop(username, ())):
+                    bucket = self._buckets[band][key]
+                    bucket.discard(username)
+                    if not bucket:
+                        del self._buckets[band][key]
+                for band, key in enumerate(keys):
+                    self._buckets[band][key].add(username)
+                self._keys[username] = keys
+
+    def candidates(self, data, exclude=None):
+        """
+        Returns the usernames sharing at least one band bucket with a profile.
+        """
+        keys = self.band_keys(data)
+        found = set()
+        with self._lock:
+            for band, key in enumerate(keys):
+                found.update(self._buckets[band].get(key, ()))
+        found.discard(exclude)
+        return found
+
+
+def recall_report(users_data, settings, k=10, sample=200, seed=0):
+    """
+    Measures LSH recall@k and query latency against an exact scan.
+
+    Args:
+        users_data (dict): Profiles to index, keyed by username.
+        settings (list): (num_perm, bands) pairs to evaluate.
+        k (int, optional): Neighbour count to compare. Defaults to 10.
+        sample (int, optional): Number of users queried per setting. Defaults to 200.
+        seed (int, optional): Seed for picking the sampled users. Defaults to 0.
+
+    Returns:
+        list: One dict per setting with recall, mean candidate count and mean
+        query latencies in milliseconds.
+    """
+    user_matrix = UserMatrix.from_users(users_data, Vocabulary())
+    rng = np.random.RandomState(seed)
+    usernames = list(users_data)
+    queries = [usernames[i] for i in rng.permutation(len(usernames))[:sample]]
+
+    exact = {}
+    started = time.perf_counter()
+    for username in queries:
+        exact[username] = user_matrix.most_similar(users_data[username], k, exclude=username)
+    exact_ms = (time.perf_counter() - started) * 1000 / max(len(queries), 1)
+
+    report = []
+    for num_perm, bands in settings:
+        index = MinHashLSH(num_perm, bands)
+        index.extend(users_data.items())
+
+        hits = total = candidates = 0
+        started = time.perf_counter()
+        for username in queries:
+            found = index.candidates(users_data[username], exclude=username)
+            approx = user_matrix.most_similar(users_data[username], k, candidates=found)
+            candidates += len(found)
+            expected = {user for user, sim in exact[username] if sim > 0}
+            hits += len(expected & {user for user, _ in approx})
+            total += len(expected)
+        elapsed = time.perf_counter() - started
+
+        report.append({
+            'num_perm': num_perm,
+            'bands': bands,
+            'rows': num_perm // bands,
+            'recall': hits / total if total else 1.0,
+            'mean_candidates': candidates / max(len(queries), 1),
+            'lsh_ms': elapsed * 1000 / max(len(queries), 1),
+            'exact_ms': exact_ms
+        })
+    return report
+
+
+if __name__ == '__main__':
+    from utils import load_user_data
+
+    parser = argparse.ArgumentParser(description="Report LSH recall versus latency for similar-user lookup.")
+    parser.add_argument('--num-perm', type=int, default=128)
+    parser.add_argument('--bands', type=int, nargs='+', default=[8, 16, 32, 64])
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--sample', type=int, default=200)
+    args = parser.parse_args()
+
+    rows = recall_report(load_user_data(), [(args.num_perm, bands) for bands in args.bands], args.k, args.sample)
+    print(f"{'bands':>6} {'rows':>5} {'recall':>7} {'cands':>8} {'lsh ms':>8} {'exact ms':>9}")
+    for row in rows:
+        print(f"{row['bands']:>6} {row['rows']:>5} {row['recall']:>7.3f} {row['mean_candidates']:>8.1f} "
+              f"{row['lsh_ms']:>8.3f} {row['exact_ms']:>9.3f}")
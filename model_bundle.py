@@ -0,0 +1,228 @@
+import fcntl
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import h5py
+
+from numpy_model import NumpySimilarityModel
+from user_matrix import UserMatrix
+from vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the layout of the saved artifact changes
+ARTIFACT_VERSION = 3
+
+# Seconds between checks for an artifact retrained by another process
+RELOAD_INTERVAL = 30
+
+# What a similarity lookup reads: the model (None until one is loaded), the
+# vocabulary and user matrix it scores against, and the model version
+ModelBundle = namedtuple('ModelBundle', ['model', 'vocabulary', 'user_matrix', 'version'])
+
+
+def read_artifact_metadata(path):
+    """
+    Returns the (vocabulary entries, model_version) stored alongside a saved model.
+
+    The entries are the [kind, name] pairs behind the model's input features,
+    in feature id order.
+
+    Raises:
+        ValueError: If the file is not a versioned artifact written by training.py.
+    """
+    with h5py.File(path, 'r') as f:
+        if f.attrs.get('artifact_version') != ARTIFACT_VERSION or 'vocabulary' not in f.attrs:
+            raise ValueError(f"{path} is not a version {ARTIFACT_VERSION} model artifact; "
+                             "retrain it with `python training.py`, or upgrade an older artifact "
+                             "with `python training.py --export`")
+        entries = json.loads(f.attrs['vocabulary'])
+        version = f.attrs['model_version']
+    return entries, version
+
+def load_artifact(path):
+    """
+    Loads a model artifact and returns (model, vocabulary entries, model_version).
+
+    Only the exported inference weights are read, so this needs h5py and NumPy
+    but not TensorFlow.
+    """
+    entries, version = read_artifact_metadata(path)
+    with h5py.File(path, 'r') as f:
+        model = NumpySimilarityModel.load(f['inference'])
+    return model, entries, version
+
+def open_vocabulary(path, model_path=None):
+    """
+    Opens the persisted vocabulary. A missing or empty one is seeded from the
+    model artifact, so feature ids agree with the model's inputs.
+    """
+    vocabulary = Vocabulary(path)
+    if not len(vocabulary) and model_path:
+        try:
+            entries, _ = read_artifact_metadata(model_path)
+        except (OSError, ValueError):
+            pass
+        else:
+            vocabulary.extend(entries)
+    return vocabulary
+
+
+class BundleHolder:
+    """
+    Holds the bundle requests are served from and swaps models in atomically.
+
+    Requests read `current` once and use that bundle throughout. All bundles
+    share one append-only vocabulary and user matrix, so a swap only replaces
+    the model, and only after checking the model was trained on a prefix of
+    the vocabulary; features added since then are simply not model inputs.
+    """
+
+    def __init__(self, vocabulary, users_data):
+        self._bundle = ModelBundle(None, vocabulary, UserMatrix.from_users(users_data, vocabulary), None)
+
+    @property
+    def current(self):
+        return self._bundle
+
+    def upsert(self, username, data):
+        """
+        Adds or refreshes a user in the current bundle and returns that bundle.
+        """
+        bundle = self._bundle
+        bundle.user_matrix.upsert(username, data)
+        return bundle
+
+    def swap(self, model, entries, version):
+        """
+        Raises:
+            ValueError: If the model's vocabulary does not match this one.
+        """
+        bundle = self._bundle
+        # The model may have been trained on features another process added
+        bundle.vocabulary.refresh()
+        if model.input_dim != len(entries) or not bundle.vocabulary.starts_with(entries):
+            raise ValueError(f"Model version {version} was trained on a different vocabulary")
+        self._bundle = bundle._replace(model=model, version=version)
+        return self._bundle
+
+
+class Retrainer(threading.Thread):
+    """
+    Retrains the similarity model in the background and hot-swaps the result.
+
+    A retrain runs every `interval` seconds and/or once `min_new_users` new users
+    have been seen, but only if at least one new user arrived since the last
+    one. Training happens in a `training.py` child process over a snapshot of
+    users_data and the shared vocabulary file, so the web process never pays
+    for it; the new artifact is then loaded and swapped in through the
+    BundleHolder.
+
+    Every worker process runs a Retrainer, but only one trains at a time: the
+    others skip their turn while the artifact's lock file is held. Each one
+    also watches the artifact's modification time and loads whatever another
+    process published.
+    """
+
+    def __init__(self, holder, users_data, model_path, interval=None, min_new_users=None, train_args=()):
+        super().__init__(name='similarity-retrainer', daemon=True)
+        self.holder = holder
+        self.users_data = users_data
+        # Absolute, so the training child and reload() see the same files
+        # whatever directory the app runs from
+        self.model_path = os.path.abspath(model_path)
+        self.vocabulary_path = os.path.abspath(holder.current.vocabulary.path)
+        self.interval = interval or None
+        self.min_new_users = min_new_users or None
+        self.train_args = list(train_args)
+
+        self._new_users = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._loaded_mtime = self._artifact_mtime()
+
+    def notify_new_user(self):
+        with self._lock:
+            self._new_users += 1
+            if self.min_new_users and self._new_users >= self.min_new_users:
+                self._wake.set()
+
+    def run(self):
+        next_retrain = time.monotonic() + self.interval if self.interval else None
+        while True:
+            timeout = RELOAD_INTERVAL
+            if next_retrain is not None:
+                timeout = min(timeout, max(next_retrain - time.monotonic(), 0))
+            woken = self._wake.wait(timeout)
+            self._wake.clear()
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Loading the retrained similarity model failed")
+
+            if not woken and (next_retrain is None or time.monotonic() < next_retrain):
+                continue
+            if self.interval:
+                next_retrain = time.monotonic() + self.interval
+            with self._lock:
+                new_users, self._new_users = self._new_users, 0
+            if not new_users:
+                continue
+            try:
+                if not self.retrain():
+                    # Another process is training; these users count towards the next turn
+                    with self._lock:
+                        self._new_users += new_users
+            except Exception:
+                logger.exception("Retraining the similarity model failed")
+
+    def _artifact_mtime(self):
+        try:
+            return os.stat(self.model_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        """
+        Swaps in the artifact if it changed since this process last loaded it.
+        """
+        mtime = self._artifact_mtime()
+        if mtime is None or mtime == self._loaded_mtime:
+            return
+        self._loaded_mtime = mtime
+        model, entries, version = load_artifact(self.model_path)
+        if version != self.holder.current.version:
+            self.holder.swap(model, entries, version)
+            logger.info("Swapped in retrained similarity model version %s", version)
+
+    def retrain(self):
+        """
+        Trains a new artifact and swaps it in, unless another process is training.
+
+        Returns:
+            bool: False if the retrain was skipped.
+        """
+        with open(f"{self.model_path}.lock", 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Similarity model is being retrained by another process")
+                return False
+            with tempfile.TemporaryDirectory() as data_dir:
+                with open(os.path.join(data_dir, 'users.json'), 'w') as f:
+                    json.dump(list(dict(self.users_data).values()), f)
+                subprocess.run(
+                    [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'training.py'),
+                     '--data-dir', data_dir, '--output', self.model_path,
+                     '--vocabulary', self.vocabulary_path] + self.train_args,
+                    check=True
+                )
+        self.reload()
+        return True
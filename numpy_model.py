@@ -0,0 +1,66 @@
+import numpy as np
+
+_ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0),
+    'sigmoid': lambda x: np.exp(-np.logaddexp(0, -x))
+}
+
+
+class NumpySimilarityModel:
+    """
+    NumPy forward pass of the Dense similarity network built in training.py.
+
+    Serving only needs the layer weights, so this keeps TensorFlow out of the
+    web process. predict() scores a whole batch of pair vectors, dense or
+    scipy sparse, in one chain of matrix products.
+    """
+
+    def __init__(self, layers):
+        # [(kernel, bias, activation)] in forward order
+        self.layers = [
+            (np.asarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32), activation)
+            for kernel, bias, activation in layers
+        ]
+        for _, _, activation in self.layers:
+            if activation not in _ACTIVATIONS:
+                raise ValueError(f"Unsupported activation: {activation}")
+
+    @property
+    def input_dim(self):
+        return self.layers[0][0].shape[0]
+
+    @classmethod
+    def from_keras(cls, model):
+        layers = []
+        for layer in model.layers:
+            kernel, bias = layer.get_weights()
+            layers.append((kernel, bias, layer.get_config()['activation']))
+        return cls(layers)
+
+    def save(self, group):
+        """
+        Writes the layers into an h5py group as layer_<i>/kernel and layer_<i>/bias.
+        """
+        for i, (kernel, bias, activation) in enumerate(self.layers):
+            layer = group.create_group(f'layer_{i}')
+            layer.create_dataset('kernel', data=kernel)
+            layer.create_dataset('bias', data=bias)
+            layer.attrs['activation'] = activation
+
+    @classmethod
+    def load(cls, group):
+        layers = []
+        for i in range(len(group)):
+            layer = group[f'layer_{i}']
+            layers.append((layer['kernel'][()], layer['bias'][()], layer.attrs['activation']))
+        return cls(layers)
+
+    def predict(self, pairs):
+        """
+        Returns one similarity score in [0, 1] per row of pairs.
+        """
+        hidden = pairs
+        for kernel, bias, activation in self.layers:
+            hidden = _ACTIVATIONS[activation](hidden @ kernel + bias)
+        return np.asarray(hidden).ravel()
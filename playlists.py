@@ -0,0 +1,157 @@
+import threading
+from collections import deque
+
+from config import Config
+from response_cache import ResponseCache
+from spotify_client import SpotifyError, get_client
+
+# Spotify's maximum page size for playlist items
+PAGE_SIZE = 100
+
+# Playlist metadata fetched up front: everything the views show, plus the
+# snapshot id and track count that drive the cache and the page requests
+_PLAYLIST_FIELDS = 'id,name,description,public,owner(id,display_name),snapshot_id,tracks.total'
+
+
+class PlaylistFetcher:
+    """
+    Fetches every track of a playlist, however many pages it spans.
+
+    Instead of following `next` links one page at a time, page offsets are
+    computed from the track count and up to `prefetch` pages are requested at
+    once through the client's thread pool. Tracks are yielded in playlist
+    order as soon as their page arrives, so callers can stream them.
+
+    Complete track lists are cached under the playlist's snapshot_id, which
+    Spotify changes on every edit: an unchanged playlist costs one small
+    metadata request and no page requests.
+    """
+
+    def __init__(self, client, prefetch=4, cache_size=256):
+        self.client = client
+        self.prefetch = max(prefetch, 1)
+        self._cache = ResponseCache(cache_size)  # {playlist_id: tracks, with the snapshot_id as etag}
+
+    def open(self, playlist_id, token):
+        """
+        Returns (playlist, tracks): the playlist's metadata and an iterator
+        over all of its track items, in order.
+
+        Raises:
+            SpotifyError: If the metadata request fails; failures of later
+                page requests are raised while iterating.
+        """
+        playlist = self.client.get(f'playlists/{playlist_id}', token, params={'fields': _PLAYLIST_FIELDS})
+        snapshot_id = playlist['snapshot_id']
+        entry = self._cache.get(playlist_id)
+        if entry is not None and entry.etag == snapshot_id:
+            return playlist, iter(entry.body)
+        return playlist, self._tracks(playlist_id, token, snapshot_id, playlist['tracks']['total'])
+
+    def _tracks(self, playlist_id, token, snapshot_id, total):
+        offsets = iter(range(0, total, PAGE_SIZE))
+        pending = deque()
+
+        def request_next_page():
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append(self.client.submit('GET', f'playlists/{playlist_id}/tracks', token,
+                                                  params={'offset': offset, 'limit': PAGE_SIZE}))
+
+        for _ in range(self.prefetch):
+            request_next_page()
+
+        tracks = []
+        try:
+            while pending:
+                page = pending.popleft().result()
+                request_next_page()
+                for item in page['items']:
+                    tracks.append(item)
+                    yield item
+        finally:
+            # Abandoned by the consumer, e.g. a closed connection
+            for future in pending:
+                future.cancel()
+        self._cache.put(playlist_id, tracks, etag=snapshot_id)
+
+
+def _chunks(uris):
+    return [uris[start:start + PAGE_SIZE] for start in range(0, len(uris), PAGE_SIZE)]
+
+
+def _chunk_result(index, chunk, response=None, error=None):
+    result = {'chunk': index, 'count': len(chunk), 'first_uri': chunk[0]}
+    if error is not None:
+        result.update(ok=False, status=error.status, error=error.message)
+    elif response is None:
+        result.update(ok=False, status=None, error='Skipped after an earlier chunk failed')
+    else:
+        result.update(ok=True, snapshot_id=response.get('snapshot_id'))
+    return result
+
+
+def add_tracks(client, playlist_id, token, uris):
+    """
+    Appends track URIs to a playlist in batches of up to 100, keeping their order.
+
+    Batches go out one after another over the client's pooled connection:
+    concurrent appends could land in any order. Once a batch fails, the
+    remaining ones are skipped so the playlist never has gaps mid-list.
+
+    Returns:
+        list: One result dict per batch, in order.
+    """
+    results = []
+    failed = False
+    for index, chunk in enumerate(_chunks(uris)):
+        if failed:
+            results.append(_chunk_result(index, chunk))
+            continue
+        try:
+            response = client.post(f'playlists/{playlist_id}/tracks', token, json={'uris': chunk})
+        except SpotifyError as e:
+            failed = True
+            results.append(_chunk_result(index, chunk, error=e))
+        else:
+            results.append(_chunk_result(index, chunk, response or {}))
+    return results
+
+
+def remove_tracks(client, playlist_id, token, uris):
+    """
+    Removes track URIs from a playlist in batches of up to 100.
+
+    Removal does not depend on order, so the batches run concurrently.
+
+    Returns:
+        list: One result dict per batch, in order.
+    """
+    chunks = _chunks(uris)
+    futures = [
+        client.submit('DELETE', f'playlists/{playlist_id}/tracks', token, json={'tracks': [{'uri': uri} for uri in chunk]})
+        for chunk in chunks
+    ]
+    results = []
+    for index, (chunk, future) in enumerate(zip(chunks, futures)):
+        try:
+            results.append(_chunk_result(index, chunk, future.result() or {}))
+        except SpotifyError as e:
+            results.append(_chunk_result(index, chunk, error=e))
+    return results
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_playlist_fetcher():
+    """
+    Returns the process-wide fetcher, created from Config on first use.
+    """
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = PlaylistFetcher(get_client(), Config.PLAYLIST_PREFETCH_PAGES, Config.PLAYLIST_CACHE_SIZE)
+    return _fetcher
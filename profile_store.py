@@ -0,0 +1,419 @@
+import argparse
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from config import Config
+
+# Profile fields holding lists of names, stored as interned ids
+NAME_FIELDS = ('top_artists', 'top_songs', 'genres')
+
+# Snapshot layout: magic, header length, JSON header, then 8-byte aligned arrays
+SNAPSHOT_MAGIC = b'SPUSNAP1'
+SNAPSHOT_VERSION = 1
+_HEADER_LENGTH = struct.Struct('<Q')
+
+logger = logging.getLogger(__name__)
+
+
+class UserProfile:
+    """
+    Compact record of one user: each name list is an array of interned string
+    ids, and any other profile fields are kept as they are in `extra`.
+    """
+
+    __slots__ = ('username', 'top_artists', 'top_songs', 'genres', 'extra')
+
+    def __init__(self, username, top_artists, top_songs, genres, extra=None):
+        self.username = username
+        self.top_artists = top_artists
+        self.top_songs = top_songs
+        self.genres = genres
+        self.extra = extra
+
+
+class _Strings:
+    # Read-only sequence of the strings packed in a snapshot's bytes/offsets
+    # arrays, decoded one at a time on access
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+
+class _Permuted:
+    # A sequence read in the order of an index array, for bisecting strings
+    # that are stored unsorted
+
+    def __init__(self, items, order):
+        self._items = items
+        self._order = order
+
+    def __len__(self):
+        return len(self._order)
+
+    def __getitem__(self, i):
+        return self._items[self._order[i]]
+
+
+def data_sources(data_dir):
+    """
+    Returns {filename: [size, mtime_ns]} of the .json files in data_dir.
+    """
+    sources = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith('.json'):
+            stat = os.stat(os.path.join(data_dir, filename))
+            sources[filename] = [stat.st_size, stat.st_mtime_ns]
+    return sources
+
+
+class ProfileSnapshot:
+    """
+    Read-only view of a profile snapshot file, memory-mapped.
+
+    The file holds the interned names, the usernames, one CSR (indptr,
+    indices) pair per name field and any extra profile fields as JSON, one
+    row per user in the order they were loaded. Nothing is parsed up front:
+    every array is a numpy view into the mapping, so opening is near-instant
+    and processes that open the same file share its pages through the OS page
+    cache. Users are found by binary search over a sorted index of the rows.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a profile snapshot")
+        start = len(SNAPSHOT_MAGIC)
+        (header_length,) = _HEADER_LENGTH.unpack_from(self._mmap, start)
+        start += _HEADER_LENGTH.size
+        header = json.loads(self._mmap[start:start + header_length])
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has snapshot version {header['version']}, expected {SNAPSHOT_VERSION}")
+        self.sources = header['sources']
+
+        start += header_length
+        arrays = {}
+        for name, (offset, dtype, length) in header['arrays'].items():
+            arrays[name] = np.frombuffer(self._mmap, dtype=dtype, count=length, offset=start + offset)
+        self.names = _Strings(arrays['name_bytes'], arrays['name_offsets'])
+        self.usernames = _Strings(arrays['user_bytes'], arrays['user_offsets'])
+        self._fields = {field: (arrays[f'{field}_indptr'], arrays[f'{field}_indices']) for field in NAME_FIELDS}
+        self._extra = _Strings(arrays['extra_bytes'], arrays['extra_offsets'])
+        self._sorted = _Permuted(self.usernames, arrays['sorted_rows'])
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def row(self, username):
+        """
+        Returns the row of a user, or None.
+        """
+        i = bisect.bisect_left(self._sorted, username)
+        if i < len(self._sorted) and self._sorted[i] == username:
+            return int(self._sorted._order[i])
+        return None
+
+    def profile(self, row):
+        ids = []
+        for field in NAME_FIELDS:
+            indptr, indices = self._fields[field]
+            ids.append(indices[indptr[row]:indptr[row + 1]])
+        extra = self._extra[row]
+        return UserProfile(self.usernames[row], *ids, extra=json.loads(extra) if extra else None)
+
+
+def write_snapshot(store, path, sources=None):
+    """
+    Writes the profiles of a store to a snapshot file at path.
+
+    The file is written next to path and renamed into place, so processes
+    opening it concurrently see either the old or the new snapshot.
+
+    Args:
+        store (ProfileStore): Profiles to write.
+        path (str): Snapshot file to create or replace.
+        sources (dict, optional): data_sources() of the JSON the store was
+            loaded from, kept to tell when the snapshot is out of date.
+    """
+    def packed(strings):
+        encoded = [string.encode('utf-8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    profiles = store.profiles()
+    arrays = {}
+    arrays['name_bytes'], arrays['name_offsets'] = packed(store.name(i) for i in range(store.n_names))
+    arrays['user_bytes'], arrays['user_offsets'] = packed(profile.username for profile in profiles)
+    for field in NAME_FIELDS:
+        lists = [getattr(profile, field) for profile in profiles]
+        indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in lists], out=indptr[1:])
+        arrays[f'{field}_indptr'] = indptr
+        arrays[f'{field}_indices'] = np.fromiter((i for ids in lists for i in ids), dtype=np.uint32, count=indptr[-1])
+    arrays['extra_bytes'], arrays['extra_offsets'] = packed(
+        json.dumps(profile.extra) if profile.extra else '' for profile in profiles
+    )
+    arrays['sorted_rows'] = np.array(
+        sorted(range(len(profiles)), key=lambda row: profiles[row].username), dtype=np.int64
+    )
+
+    # Array offsets are relative to the end of the (padded) header
+    layout = {}
+    offset = 0
+    for name, values in arrays.items():
+        layout[name] = [offset, values.dtype.str, len(values)]
+        offset += -(-values.nbytes // 8) * 8
+    header = {'version': SNAPSHOT_VERSION, 'sources': sources or {}, 'arrays': layout}
+    encoded_header = json.dumps(header).encode('utf-8')
+    encoded_header += b' ' * (-(len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size + len(encoded_header)) % 8)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(encoded_header)))
+        f.write(encoded_header)
+        for values in arrays.values():
+            data = values.tobytes()
+            f.write(data)
+            f.write(b'\0' * (-len(data) % 8))
+    os.replace(tmp_path, path)
+
+
+class ProfileStore(MutableMapping):
+    """
+    User profiles keyed by username, with every artist, song and genre name
+    interned to an integer id.
+
+    Each name is stored once however many users list it, and each user is a
+    UserProfile whose lists are arrays of 4-byte ids rather than lists of
+    string references. The store is a mapping of username to the profile dict,
+    decoded on access, so it can stand in for the plain dict of profiles;
+    profile(), ids() and name() give access to the compact form without
+    decoding.
+
+    A store can sit on top of a memory-mapped ProfileSnapshot: its users and
+    names are read from the snapshot, and users added or changed afterwards
+    are kept in memory on top of it.
+    """
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self._base_names = len(snapshot.names) if snapshot is not None else 0
+        self._names = []  # names interned after the snapshot, ids from _base_names on
+        self._name_ids = None  # {name: id}, built on first use
+        self._profiles = {}  # {username: UserProfile}, overriding the snapshot
+        self._removed = set()  # snapshot users deleted since
+        self._len = len(snapshot) if snapshot is not None else 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_dir(cls, data_dir='data', workers=None):
+        """
+        Loads every .json file in data_dir: a list of profiles or a single one.
+
+        Files are streamed and parsed in parallel; see ingest.ingest().
+        """
+        from ingest import ingest
+
+        return ingest(cls(), data_dir, workers)
+
+    @property
+    def n_names(self):
+        return self._base_names + len(self._names)
+
+    def _ids_by_name(self):
+        # Only needed to intern new names, so a read-only store never builds it
+        if self._name_ids is None:
+            names = self.snapshot.names if self.snapshot is not None else ()
+            name_ids = {name: i for i, name in enumerate(names)}
+            name_ids.update((name, self._base_names + i) for i, name in enumerate(self._names))
+            self._name_ids = name_ids
+        return self._name_ids
+
+    def _intern(self, name):
+        name_ids = self._ids_by_name()
+        name_id = name_ids.get(name)
+        if name_id is None:
+            name_id = name_ids[name] = self.n_names
+            self._names.append(sys.intern(name))
+        return name_id
+
+    def intern_all(self, names):
+        """
+        Returns the ids of the given names, interning the ones not seen yet.
+        """
+        with self._lock:
+            return [self._intern(name) for name in names]
+
+    def _snapshot_row(self, username):
+        if self.snapshot is None or username in self._removed:
+            return None
+        return self.snapshot.row(username)
+
+    def _decode(self, profile):
+        data = {'username': profile.username}
+        for field in NAME_FIELDS:
+            data[field] = [self.name(name_id) for name_id in getattr(profile, field)]
+        if profile.extra:
+            data.update(profile.extra)
+        return data
+
+    def __getitem__(self, username):
+        profile = self.profile(username)
+        if profile is None:
+            raise KeyError(username)
+        return self._decode(profile)
+
+    def __setitem__(self, username, data):
+        extra = {key: value for key, value in data.items() if key != 'username' and key not in NAME_FIELDS}
+        with self._lock:
+            ids = [array('I', (self._intern(name) for name in data.get(field, ()))) for field in NAME_FIELDS]
+        self.put_ids(username, ids, extra or None)
+
+    def put_ids(self, username, ids, extra=None):
+        """
+        Adds or replaces a user given as already interned ids, one array('I')
+        per name field.
+        """
+        with self._lock:
+            if username not in self:
+                self._len += 1
+            self._profiles[username] = UserProfile(username, *ids, extra=extra)
+
+    def __delitem__(self, username):
+        with self._lock:
+            if username not in self:
+                raise KeyError(username)
+            self._profiles.pop(username, None)
+            if self._snapshot_row(username) is not None:
+                self._removed.add(username)
+            self._len -= 1
+
+    def __contains__(self, username):
+        return username in self._profiles or self._snapshot_row(username) is not None
+
+    def __iter__(self):
+        # Snapshot users first, then those only held in memory, from a copy
+        # of the keys as request threads may add users meanwhile
+        added = list(self._profiles)
+        if self.snapshot is not None:
+            for username in self.snapshot.usernames:
+                if username not in self._removed:
+                    yield username
+        for username in added:
+            if self._snapshot_row(username) is None:
+                yield username
+
+    def __len__(self):
+        return self._len
+
+    def profile(self, username):
+        """
+        Returns the UserProfile record of a user, or None.
+        """
+        profile = self._profiles.get(username)
+        if profile is None:
+            row = self._snapshot_row(username)
+            if row is not None:
+                profile = self.snapshot.profile(row)
+        return profile
+
+    def profiles(self):
+        """
+        Returns all UserProfile records.
+        """
+        return [self.profile(username) for username in self]
+
+    def ids(self, names):
+        """
+        Returns the ids of the given names, None for names never seen.
+        """
+        name_ids = self._ids_by_name()
+        return [name_ids.get(name) for name in names]
+
+    def name(self, name_id):
+        if name_id < self._base_names:
+            return self.snapshot.names[name_id]
+        return self._names[name_id - self._base_names]
+
+
+def load_profiles(data_dir='data', snapshot_path=None, workers=None):
+    """
+    Returns a ProfileStore of the profiles in data_dir.
+
+    With snapshot_path, the store is opened from that snapshot, which is
+    first (re)compiled from the JSON files if it is missing or any of them
+    was added, removed or changed since it was written.
+    """
+    if not snapshot_path:
+        return ProfileStore.from_dir(data_dir, workers)
+
+    sources = data_sources(data_dir)
+    try:
+        snapshot = ProfileSnapshot(snapshot_path)
+    except (OSError, ValueError):
+        snapshot = None
+    if snapshot is None or snapshot.sources != sources:
+        store = ProfileStore.from_dir(data_dir, workers)
+        started = time.perf_counter()
+        write_snapshot(store, snapshot_path, sources)
+        logger.info("Wrote snapshot %s in %.2f s", snapshot_path, time.perf_counter() - started)
+        snapshot = ProfileSnapshot(snapshot_path)
+    else:
+        logger.info("Opened snapshot %s (%d users)", snapshot_path, len(snapshot))
+    return ProfileStore(snapshot)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_profile_store():
+    """
+    Returns the process-wide profile store, loaded from Config.DATA_DIR (through
+    the Config.DATA_SNAPSHOT snapshot, if set) on first use.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = load_profiles(Config.DATA_DIR, Config.DATA_SNAPSHOT, Config.INGEST_WORKERS)
+    return _store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the JSON user dataset into a memory-mappable snapshot.")
+    parser.add_argument('--data-dir', default=Config.DATA_DIR)
+    parser.add_argument('--output', default=Config.DATA_SNAPSHOT or 'profiles.snapshot')
+    parser.add_argument('--workers', type=int, default=Config.INGEST_WORKERS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    sources = data_sources(args.data_dir)
+    store = ProfileStore.from_dir(args.data_dir, args.workers)
+    write_snapshot(store, args.output, sources)
+    print(f"Wrote {len(store)} profiles and {store.n_names} names from {len(sources)} files to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'fetched_at', 'ttl'])
+
+
+class ResponseCache:
+    """
+    Size-bounded LRU cache of API responses with per-entry freshness.
+
+    Entries keep their ETag so an expired entry can be revalidated with
+    If-None-Match instead of downloaded again. Once max_entries is reached
+    the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the CachedResponse for key, fresh or not, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, etag=None, ttl=0):
+        with self._lock:
+            self._entries[key] = CachedResponse(body, etag, time.time(), ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls: while a call for a key is running, other
+    callers with the same key wait for it and share its result or error.
+    """
+
+    def __init__(self):
+        self._calls = {}  # {key: Future of the running call}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+
+        if leader:
+            try:
+                future.set_result(fn())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        return future.result()
@@ -1,8 +1,5 @@
-from flask import Blueprint
-
-user_routes = Blueprint('user_routes', __name__)
-playlist_routes = Blueprint('playlist_routes', __name__)
-recommendation_routes = Blueprint('recommendation_routes', __name__)
-group_routes = Blueprint('group_routes', __name__)
-
-from . import user_routes, playlist_routes, recommendation_routes, group_routes
+# The blueprints, each defined in its own module. User pages, follows,
+# messages, comments, likes and ratings are served by app.py itself.
+from .playlist_routes import playlist_routes
+from .recommendation_routes import recommendation_routes
+from .group_routes import group_routes
@@ -1,12 +1,66 @@
 #Manages groups, allowing users to join, leave, and share recommendations within groups.
 
-from flask import Blueprint, request, jsonify, session, redirect, url_for, render_template
-from collections import defaultdict
+from flask import Blueprint, request, jsonify, session, redirect, url_for, render_template, current_app
+
+import numpy as np
+
+from group_store import get_group_store
+from profile_store import get_profile_store
+from spotify_client import SpotifyError, get_client
+from user_matrix import named_features
 
 group_routes = Blueprint('group_routes', __name__)
 
-# In-memory store for group data
-groups = defaultdict(dict)  # {group_name: {members: set(), recommendations: list()}}
+# Groups, members and recommendations, shared by all workers through SQLite
+groups = get_group_store()
+
+# Spotify seeds drawn from a group's taste; genres are left out, as Spotify
+# only takes seed genres from its own fixed list
+GROUP_SEED_ARTISTS = 3
+GROUP_SEED_TRACKS = 2
+
+def _user_matrix():
+    return current_app.extensions['similarity_bundles'].current.user_matrix
+
+def _member_features(username):
+    """
+    Returns the user's {(kind, name): value} vector, or None while this
+    process has no profile for them (the group store then uses the last one
+    stored).
+    """
+    profile = get_profile_store().get(username)
+    if profile is None:
+        return None
+    return named_features(profile)
+
+def _similar_users(taste, members):
+    """
+    Returns the non-members closest to a group taste, with one product against the user matrix.
+    """
+    user_matrix = _user_matrix()
+    # The taste is stored by name; ids are only valid in this process's
+    # vocabulary. A name it has never seen is in no user row, so it is
+    # dropped rather than given an id, but still counts in the norm
+    ids = user_matrix.vocabulary.lookup(taste, grow=False)
+    indices = np.array([i for i in ids if i is not None], dtype=np.int32)
+    values = np.array([value for i, value in zip(ids, taste.values()) if i is not None], dtype=np.float64)
+    norm = np.linalg.norm(np.fromiter(taste.values(), dtype=np.float64, count=len(taste)))
+    return user_matrix.nearest(indices, values, k=10, exclude=members, norm=norm)
+
+def _taste_seeds(taste):
+    """
+    Returns the names of the top artists and songs of a group taste, strongest first.
+    """
+    artists, songs = [], []
+    # One sort of the centroid ranks every feature; ties go by name
+    for (kind, name), _ in sorted(taste.items(), key=lambda item: (-item[1], item[0])):
+        if kind == 'artist' and len(artists) < GROUP_SEED_ARTISTS:
+            artists.append(name)
+        elif kind == 'song' and len(songs) < GROUP_SEED_TRACKS:
+            songs.append(name)
+        if len(artists) == GROUP_SEED_ARTISTS and len(songs) == GROUP_SEED_TRACKS:
+            break
+    return artists, songs
 
 @group_routes.route('/')
 def view_groups():
@@ -14,7 +68,7 @@ def view_groups():
     if not current_user:
         return redirect(url_for('index'))
 
-    user_groups = [group_name for group_name, data in groups.items() if current_user in data['members']]
+    user_groups = groups.groups_of(current_user)
     return render_template('groups.html', groups=user_groups)
 
 @group_routes.route('/create', methods=['GET', 'POST'])
@@ -25,12 +79,11 @@ def create_group():
 
     if request.method == 'POST':
         group_name = request.form['group_name']
-        if group_name in groups:
+        if not groups.create(group_name, current_user, _member_features(current_user)):
             return "Group already exists", 400
-        groups[group_name] = {'members': {current_user}, 'recommendations': []}
         return redirect(url_for('group_routes.view_groups'))
 
-    return render_template('create_group.html')
+    return render_template('create_groups.html')
 
 @group_routes.route('/<group_name>/join')
 def join_group(group_name):
@@ -38,10 +91,10 @@ def join_group(group_name):
     if not current_user:
         return redirect(url_for('index'))
 
-    if group_name not in groups:
+    if not groups.exists(group_name):
         return "Group not found", 404
 
-    groups[group_name]['members'].add(current_user)
+    groups.join(group_name, current_user, _member_features(current_user))
     return redirect(url_for('group_routes.view_groups'))
 
 @group_routes.route('/<group_name>/leave')
@@ -50,10 +103,9 @@ def leave_group(group_name):
     if not current_user:
         return redirect(url_for('index'))
 
-    if group_name not in groups or current_user not in groups[group_name]['members']:
+    if not groups.leave(group_name, current_user):
         return "Group not found or not a member", 404
 
-    groups[group_name]['members'].remove(current_user)
     return redirect(url_for('group_routes.view_groups'))
 
 @group_routes.route('/<group_name>/recommend', methods=['GET', 'POST'])
@@ -62,12 +114,12 @@ def recommend_to_group(group_name):
     if not current_user:
         return redirect(url_for('index'))
 
-    if group_name not in groups or current_user not in groups[group_name]['members']:
+    if not groups.is_member(group_name, current_user):
         return "Group not found or not a member", 404
 
     if request.method == 'POST':
         recommendation = request.form['recommendation']
-        groups[group_name]['recommendations'].append({'from': current_user, 'content': recommendation})
+        groups.add_recommendation(group_name, current_user, recommendation)
         return redirect(url_for('group_routes.view_group_recommendations', group_name=group_name))
 
     return render_template('recommend_to_group.html', group_name=group_name)
@@ -78,8 +130,51 @@ def view_group_recommendations(group_name):
     if not current_user:
         return redirect(url_for('index'))
 
-    if group_name not in groups or current_user not in groups[group_name]['members']:
+    if not groups.is_member(group_name, current_user):
+        return "Group not found or not a member", 404
+
+    group_recommendations, newer = groups.recommendations(
+        group_name, current_app.config['GROUP_RECOMMENDATIONS_PAGE_SIZE'], request.args.get('after', type=int)
+    )
+    taste = groups.taste(group_name)
+    similar_users = _similar_users(taste, groups.members(group_name)) if taste else []
+    return render_template('group_recommendations.html', group_name=group_name, recommendations=group_recommendations,
+                           newer=newer, similar_users=similar_users)
+
+@group_routes.route('/<group_name>/spotify')
+def spotify_group_recommendations(group_name):
+    current_user = session.get('user_id')
+    token_info = session.get('token_info')
+    if not current_user or not token_info:
+        return redirect(url_for('index'))
+
+    if not groups.is_member(group_name, current_user):
         return "Group not found or not a member", 404
 
-    group_recommendations = groups[group_name]['recommendations']
-    return render_template('group_recommendations.html', group_name=group_name, recommendations=group_recommendations)
+    taste = groups.taste(group_name)
+    if not taste:
+        return "The group has no taste profile yet", 404
+    artists, songs = _taste_seeds(taste)
+
+    # The vocabulary holds names; the searches for their Spotify ids run concurrently
+    spotify = get_client()
+    token = token_info['access_token']
+    searches = [spotify.submit('GET', 'search', token, params={'q': name, 'type': 'artist', 'limit': 1})
+                for name in artists]
+    searches += [spotify.submit('GET', 'search', token, params={'q': name, 'type': 'track', 'limit': 1})
+                 for name in songs]
+    seed_artists, seed_tracks = [], []
+    for i, search in enumerate(searches):
+        try:
+            results = search.result()
+        except SpotifyError:
+            continue
+        if i < len(artists):
+            seed_artists.extend(artist['id'] for artist in results.get('artists', {}).get('items', []))
+        else:
+            seed_tracks.extend(track['id'] for track in results.get('tracks', {}).get('items', []))
+    if not seed_artists and not seed_tracks:
+        return "None of the group's favourites were found on Spotify", 502
+
+    recommendations = spotify.recommendations(token, seed_artists=seed_artists, seed_tracks=seed_tracks, limit=10)
+    return render_template('recommendations.html', recommendations=recommendations)
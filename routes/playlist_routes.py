@@ -1,5 +1,10 @@
-from flask import Blueprint, request, jsonify, session, redirect, url_for, render_template
-import requests
+import json
+
+from flask import Blueprint, Response, request, jsonify, session, redirect, url_for, render_template, stream_template, stream_with_context
+
+from async_spotify import get_async_client
+from playlists import add_tracks, get_playlist_fetcher, remove_tracks
+from spotify_client import get_client
 
 playlist_routes = Blueprint('playlist_routes', __name__)
 
@@ -9,14 +14,27 @@ def view_playlist(playlist_id):
     if not token_info:
         return redirect(url_for('index'))
 
-    headers = {
-        'Authorization': f"Bearer {token_info['access_token']}"
-    }
+    # Tracks are rendered as their pages arrive
+    playlist, tracks = get_playlist_fetcher().open(playlist_id, token_info['access_token'])
+
+    return stream_template('view_playlist.html', playlist=playlist, tracks=tracks)
+
+@playlist_routes.route('/<playlist_id>/tracks')
+def playlist_tracks(playlist_id):
+    token_info = session.get('token_info')
+    if not token_info:
+        return redirect(url_for('index'))
+
+    playlist, tracks = get_playlist_fetcher().open(playlist_id, token_info['access_token'])
 
-    response = requests.get(f'https://api.spotify.com/v1/playlists/{playlist_id}', headers=headers)
-    playlist = response.json()
+    # Stream a JSON document with every track item, one page at a time
+    def generate():
+        yield '{"id": %s, "snapshot_id": %s, "items": [' % (json.dumps(playlist['id']), json.dumps(playlist['snapshot_id']))
+        for i, item in enumerate(tracks):
+            yield (',' if i else '') + json.dumps(item)
+        yield ']}'
 
-    return render_template('view_playlist.html', playlist=playlist)
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 @playlist_routes.route('/create', methods=['GET', 'POST'])
 def create_playlist():
@@ -27,24 +45,12 @@ def create_playlist():
 
     if request.method == 'POST':
         playlist_name = request.form['name']
-        headers = {
-            'Authorization': f"Bearer {token_info['access_token']}",
-            'Content-Type': 'application/json'
-        }
-        payload = json.dumps({
+        playlist = get_client().post(f'users/{current_user}/playlists', token_info['access_token'], json={
             'name': playlist_name,
             'description': 'New playlist created through app',
             'public': False
         })
-        response = requests.post(
-            f'https://api.spotify.com/v1/users/{current_user}/playlists',
-            headers=headers,
-            data=payload
-        )
-        if response.status_code == 201:
-            return redirect(url_for('playlist_routes.view_playlist', playlist_id=response.json()['id']))
-        else:
-            return response.text, response.status_code
+        return redirect(url_for('playlist_routes.view_playlist', playlist_id=playlist['id']))
 
     return render_template('create_playlist.html')
 
@@ -56,22 +62,10 @@ def add_to_playlist(playlist_id):
 
     if request.method == 'POST':
         track_uri = request.form['track_uri']
-        headers = {
-            'Authorization': f"Bearer {token_info['access_token']}",
-            'Content-Type': 'application/json'
-        }
-        payload = json.dumps({
+        get_client().post(f'playlists/{playlist_id}/tracks', token_info['access_token'], json={
             'uris': [track_uri]
         })
-        response = requests.post(
-            f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
-            headers=headers,
-            data=payload
-        )
-        if response.status_code == 201:
-            return redirect(url_for('playlist_routes.view_playlist', playlist_id=playlist_id))
-        else:
-            return response.text, response.status_code
+        return redirect(url_for('playlist_routes.view_playlist', playlist_id=playlist_id))
 
     return render_template('add_to_playlist.html', playlist_id=playlist_id)
 
@@ -82,19 +76,96 @@ def remove_from_playlist(playlist_id):
         return redirect(url_for('index'))
 
     track_uri = request.form['track_uri']
-    headers = {
-        'Authorization': f"Bearer {token_info['access_token']}",
-        'Content-Type': 'application/json'
-    }
-    payload = json.dumps({
+    get_client().delete(f'playlists/{playlist_id}/tracks', token_info['access_token'], json={
         'tracks': [{'uri': track_uri}]
     })
-    response = requests.delete(
-        f'https://api.spotify.com/v1/playlists/{playlist_id}/tracks',
-        headers=headers,
-        data=payload
-    )
-    if response.status_code == 200:
+    return redirect(url_for('playlist_routes.view_playlist', playlist_id=playlist_id))
+
+def _bulk_response(results):
+    failed = [result for result in results if not result['ok']]
+    status = (failed[0]['status'] or 502) if failed else 200
+    snapshot_ids = [result['snapshot_id'] for result in results if result['ok'] and result['snapshot_id']]
+    return jsonify({'snapshot_id': snapshot_ids[-1] if snapshot_ids else None, 'chunks': results}), status
+
+def _request_uris():
+    # A JSON body {"uris": [...]}, or repeated track_uri form fields; None
+    # when a JSON body is anything but a list of strings under "uris"
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return request.form.getlist('track_uri')
+    uris = payload.get('uris') if isinstance(payload, dict) else None
+    if not isinstance(uris, list) or not all(isinstance(uri, str) for uri in uris):
+        return None
+    return uris
+
+@playlist_routes.route('/<playlist_id>/add/bulk', methods=['POST'])
+def bulk_add_to_playlist(playlist_id):
+    token_info = session.get('token_info')
+    if not token_info:
+        return redirect(url_for('index'))
+
+    uris = _request_uris()
+    if not uris:
+        return jsonify({'error': 'Expected a non-empty list of track URIs'}), 400
+    return _bulk_response(add_tracks(get_client(), playlist_id, token_info['access_token'], uris))
+
+@playlist_routes.route('/<playlist_id>/remove/bulk', methods=['POST'])
+def bulk_remove_from_playlist(playlist_id):
+    token_info = session.get('token_info')
+    if not token_info:
+        return redirect(url_for('index'))
+
+    uris = _request_uris()
+    if not uris:
+        return jsonify({'error': 'Expected a non-empty list of track URIs'}), 400
+    return _bulk_response(remove_tracks(get_client(), playlist_id, token_info['access_token'], uris))
+
+# Async variants of the views above, served instead when SPOTIFY_ASYNC is set.
+# The streaming playlist views stay sync.
+async def create_playlist_async():
+    current_user = session.get('user_id')
+    token_info = session.get('token_info')
+    if not current_user or not token_info:
+        return redirect(url_for('index'))
+
+    if request.method == 'POST':
+        spotify = get_async_client()
+        playlist = await spotify.run(spotify.post(f'users/{current_user}/playlists', token_info['access_token'], json={
+            'name': request.form['name'],
+            'description': 'New playlist created through app',
+            'public': False
+        }))
+        return redirect(url_for('playlist_routes.view_playlist', playlist_id=playlist['id']))
+
+    return render_template('create_playlist.html')
+
+async def add_to_playlist_async(playlist_id):
+    token_info = session.get('token_info')
+    if not token_info:
+        return redirect(url_for('index'))
+
+    if request.method == 'POST':
+        spotify = get_async_client()
+        await spotify.run(spotify.post(f'playlists/{playlist_id}/tracks', token_info['access_token'], json={
+            'uris': [request.form['track_uri']]
+        }))
         return redirect(url_for('playlist_routes.view_playlist', playlist_id=playlist_id))
-    else:
-        return response.text, response.status_code
+
+    return render_template('add_to_playlist.html', playlist_id=playlist_id)
+
+async def remove_from_playlist_async(playlist_id):
+    token_info = session.get('token_info')
+    if not token_info:
+        return redirect(url_for('index'))
+
+    spotify = get_async_client()
+    await spotify.run(spotify.delete(f'playlists/{playlist_id}/tracks', token_info['access_token'], json={
+        'tracks': [{'uri': request.form['track_uri']}]
+    }))
+    return redirect(url_for('playlist_routes.view_playlist', playlist_id=playlist_id))
+
+async_views = {
+    'playlist_routes.create_playlist': create_playlist_async,
+    'playlist_routes.add_to_playlist': add_to_playlist_async,
+    'playlist_routes.remove_from_playlist': remove_from_playlist_async
+}
@@ -1,5 +1,7 @@
 from flask import Blueprint, request, jsonify, session, redirect, url_for, render_template
-import requests
+
+from async_spotify import get_async_client
+from spotify_client import get_client
 
 recommendation_routes = Blueprint('recommendation_routes', __name__)
 
@@ -9,23 +11,13 @@ def recommend():
     if not token_info:
         return redirect(url_for('index'))
 
-    headers = {
-        'Authorization': f"Bearer {token_info['access_token']}"
-    }
-
-    seed_artists = request.args.getlist('seed_artists')
-    seed_tracks = request.args.getlist('seed_tracks')
-    seed_genres = request.args.getlist('seed_genres')
-
-    params = {
-        'seed_artists': ','.join(seed_artists),
-        'seed_tracks': ','.join(seed_tracks),
-        'seed_genres': ','.join(seed_genres),
-        'limit': 10
-    }
-
-    response = requests.get('https://api.spotify.com/v1/recommendations', headers=headers, params=params)
-    recommendations = response.json()
+    recommendations = get_client().recommendations(
+        token_info['access_token'],
+        seed_artists=request.args.getlist('seed_artists'),
+        seed_tracks=request.args.getlist('seed_tracks'),
+        seed_genres=request.args.getlist('seed_genres'),
+        limit=10
+    )
 
     return render_template('recommendations.html', recommendations=recommendations)
 
@@ -36,28 +28,56 @@ def recommend_based_on_top():
     if not current_user or not token_info:
         return redirect(url_for('index'))
 
-    headers = {
-        'Authorization': f"Bearer {token_info['access_token']}"
-    }
+    spotify = get_client()
+    token = token_info['access_token']
+    top_artists, top_tracks = spotify.get_all(['me/top/artists', 'me/top/tracks'], token)
+    recommendations = spotify.recommendations(token, *top_seeds(top_artists, top_tracks), limit=10)
 
-    top_artists_response = requests.get('https://api.spotify.com/v1/me/top/artists', headers=headers)
-    top_tracks_response = requests.get('https://api.spotify.com/v1/me/top/tracks', headers=headers)
+    return render_template('recommendations.html', recommendations=recommendations)
 
-    top_artists = top_artists_response.json().get('items', [])
-    top_tracks = top_tracks_response.json().get('items', [])
+def top_seeds(top_artists, top_tracks):
+    """
+    Returns (seed_artists, seed_tracks, seed_genres) from top artists and tracks responses.
+    """
+    top_artists = top_artists.get('items', [])
+    top_tracks = top_tracks.get('items', [])
 
     seed_artists = [artist['id'] for artist in top_artists[:5]]
     seed_tracks = [track['id'] for track in top_tracks[:5]]
-    seed_genres = list(set(genre for artist in top_artists for genre in artist.get('genres', [])))[:5]
+    seed_genres = sorted(set(genre for artist in top_artists for genre in artist.get('genres', [])))[:5]
+    return seed_artists, seed_tracks, seed_genres
 
-    params = {
-        'seed_artists': ','.join(seed_artists),
-        'seed_tracks': ','.join(seed_tracks),
-        'seed_genres': ','.join(seed_genres),
-        'limit': 10
-    }
+# Async variants of the views above, served instead when SPOTIFY_ASYNC is set
+async def recommend_async():
+    token_info = session.get('token_info')
+    if not token_info:
+        return redirect(url_for('index'))
 
-    response = requests.get('https://api.spotify.com/v1/recommendations', headers=headers, params=params)
-    recommendations = response.json()
+    spotify = get_async_client()
+    recommendations = await spotify.run(spotify.recommendations(
+        token_info['access_token'],
+        seed_artists=request.args.getlist('seed_artists'),
+        seed_tracks=request.args.getlist('seed_tracks'),
+        seed_genres=request.args.getlist('seed_genres'),
+        limit=10
+    ))
 
     return render_template('recommendations.html', recommendations=recommendations)
+
+async def recommend_based_on_top_async():
+    current_user = session.get('user_id')
+    token_info = session.get('token_info')
+    if not current_user or not token_info:
+        return redirect(url_for('index'))
+
+    spotify = get_async_client()
+    token = token_info['access_token']
+    top_artists, top_tracks = await spotify.run(spotify.get_all(['me/top/artists', 'me/top/tracks'], token))
+    recommendations = await spotify.run(spotify.recommendations(token, *top_seeds(top_artists, top_tracks), limit=10))
+
+    return render_template('recommendations.html', recommendations=recommendations)
+
+async_views = {
+    'recommendation_routes.recommend': recommend_async,
+    'recommendation_routes.recommend_based_on_top': recommend_based_on_top_async
+}
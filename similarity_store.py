@@ -0,0 +1,151 @@
+import heapq
+import json
+import sqlite3
+import threading
+import time
+
+
+class SimilarityStore:
+    """
+    Persistent per-user cache of similar-user lists, kept in SQLite.
+
+    The database runs in WAL mode, so several workers can read while one
+    writes and every upsert is its own atomic transaction. Each list carries
+    a version stamp and the time it was written. get() treats a list as stale,
+    and returns None for it, when the stamp differs from the one asked for or
+    when it is older than ttl seconds. Lists are read one user at a time, on
+    demand.
+
+    Lists hold at most k entries. Alongside each list the store keeps its
+    threshold, the lowest similarity in a full list (NULL while the list is
+    shorter than k), so a newcomer only has to beat that to get in.
+    """
+
+    def __init__(self, path, ttl=None, k=10):
+        self.path = path
+        self.ttl = ttl or None
+        self.k = k
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS similarities ("
+                " username TEXT PRIMARY KEY,"
+                " neighbours TEXT NOT NULL,"
+                " version TEXT,"
+                " updated_at REAL NOT NULL,"
+                " threshold REAL)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(similarities)")]
+            if 'threshold' not in columns:
+                conn.execute("ALTER TABLE similarities ADD COLUMN threshold REAL")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, username, version=None):
+        """
+        Returns the cached [(username, similarity)] list, or None if it is missing or stale.
+        """
+        row = self._connection().execute(
+            "SELECT neighbours, version, updated_at FROM similarities WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        neighbours, stored_version, updated_at = row
+        if stored_version != version or (self.ttl and time.time() - updated_at > self.ttl):
+            return None
+        return [tuple(neighbour) for neighbour in json.loads(neighbours)]
+
+    def thresholds(self, version=None):
+        """
+        Yields (username, threshold) for every fresh list with the given stamp;
+        the threshold is -inf for lists that are not full yet.
+        """
+        query = "SELECT username, threshold FROM similarities WHERE version IS ?"
+        params = [version]
+        if self.ttl:
+            query += " AND updated_at >= ?"
+            params.append(time.time() - self.ttl)
+        for username, threshold in self._connection().execute(query, params):
+            yield username, -float('inf') if threshold is None else threshold
+
+    def _threshold(self, neighbours):
+        return min(sim for _, sim in neighbours) if len(neighbours) >= self.k else None
+
+    def put(self, username, neighbours, version=None):
+        """
+        Stores one user's list and returns its threshold, -inf if the list is
+        not full, as thresholds() and add_neighbour() report it.
+        """
+        self.put_many([(username, neighbours)], version)
+        threshold = self._threshold(neighbours)
+        return -float('inf') if threshold is None else threshold
+
+    def put_many(self, items, version=None):
+        """
+        Upserts several users' lists in one transaction.
+        """
+        with self._connection() as conn:
+            self._upsert(conn, items, version)
+
+    def _upsert(self, conn, items, version):
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO similarities (username, neighbours, version, updated_at, threshold) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT(username) DO UPDATE SET"
+            " neighbours = excluded.neighbours, version = excluded.version,"
+            " updated_at = excluded.updated_at, threshold = excluded.threshold",
+            [
+                (username, json.dumps(neighbours), version, now, self._threshold(neighbours))
+                for username, neighbours in items
+            ]
+        )
+
+    def add_neighbour(self, username, owners, version=None):
+        """
+        Pushes a user into the cached lists of the given owners.
+
+        Each owner's list is treated as a min-heap of its top k: the user
+        replaces any entry they already had, then either fills a free slot or
+        displaces the current minimum. Owners without a fresh list are skipped,
+        since their list is rebuilt in full on their next visit anyway.
+
+        Args:
+            username (str): The new or updated user.
+            owners (list): (owner, similarity) pairs of users whose list the user
+                should enter, with similarity on the list's own scale.
+            version (str, optional): Stamp the lists must carry.
+
+        Returns:
+            list: (owner, threshold) for every owner, with None for owners that
+            no longer have a list and -inf for lists that are not full.
+        """
+        updated, thresholds = [], []
+        with self._connection() as conn:
+            # Taking the write lock before reading keeps another worker's
+            # additions to the same lists from being overwritten
+            conn.execute("BEGIN IMMEDIATE")
+            for owner, similarity in owners:
+                neighbours = self.get(owner, version)
+                if neighbours is None:
+                    thresholds.append((owner, None))
+                    continue
+                heap = [(sim, user) for user, sim in neighbours if user != username]
+                heapq.heapify(heap)
+                if len(heap) < self.k:
+                    heapq.heappush(heap, (similarity, username))
+                else:
+                    heapq.heappushpop(heap, (similarity, username))
+                neighbours = [(user, sim) for sim, user in sorted(heap, reverse=True)]
+                updated.append((owner, neighbours))
+                threshold = self._threshold(neighbours)
+                thresholds.append((owner, -float('inf') if threshold is None else threshold))
+            self._upsert(conn, updated, version)
+        return thresholds
@@ -0,0 +1,342 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from response_cache import ResponseCache, SingleFlight
+
+# Methods that are safe to resend after a server error or a dropped connection
+_IDEMPOTENT = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+
+class SpotifyError(Exception):
+    """
+    A failed Spotify call: an error status, or no usable response at all.
+
+    `status` is the HTTP status code, or None when the request never got a
+    response (timeouts, connection errors).
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+    @classmethod
+    def from_response(cls, response):
+        try:
+            error = response.json().get('error')
+        except ValueError:
+            error = None
+        # requests calls it reason, httpx reason_phrase
+        reason = getattr(response, 'reason', None) or getattr(response, 'reason_phrase', '')
+        if isinstance(error, dict):
+            message = error.get('message') or reason
+        else:
+            message = error or response.text or reason
+        return cls(f"Spotify API error {response.status_code}: {message}", response.status_code)
+
+
+class SpotifyClient:
+    """
+    Spotify Web API client sharing one pooled requests.Session across requests.
+
+    Connections to each host are kept alive in a pool of up to pool_size
+    connections, and every call has explicit connect and read timeouts.
+    A 429 is retried after the Retry-After delay it comes with, unless that is
+    longer than max_backoff; 5xx responses and connection failures of
+    idempotent calls are retried with jittered exponential backoff. Whatever
+    still fails is raised as a SpotifyError.
+
+    Paths are relative to base_url, which can point at a local stub server;
+    absolute URLs (such as the accounts service) are used as they are.
+
+    Independent calls can be issued concurrently with submit() or get_all();
+    they run on a thread pool as large as the connection pool.
+
+    GETs of the paths in cache_ttls ({path: seconds}) are cached per access
+    token, i.e. per user, for that many seconds. An expired entry is
+    revalidated with its ETag, so an unchanged payload costs a 304 and no
+    body. With stale_while_revalidate, an entry up to that many seconds past
+    expiry is served at once while a background call refreshes it.
+
+    recommendations() results depend only on the seeds, so they are cached
+    across users for recommendations_ttl seconds, and identical concurrent
+    requests share a single upstream call.
+    """
+
+    def __init__(self, base_url='https://api.spotify.com/v1', pool_size=20, connect_timeout=3.05,
+                 read_timeout=10, max_retries=3, backoff=0.5, max_backoff=30,
+                 cache_ttls=None, cache_size=1000, stale_while_revalidate=0, recommendations_ttl=0):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        # Retries are handled here, so the adapter itself never retries
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='spotify')
+
+        self.cache_ttls = {path: ttl for path, ttl in (cache_ttls or {}).items() if ttl}
+        self.cache = ResponseCache(cache_size)
+        self.stale_while_revalidate = stale_while_revalidate
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+
+        self.recommendations_ttl = recommendations_ttl
+        self._recommendations = ResponseCache(cache_size)
+        self._flights = SingleFlight()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            base_url=config['SPOTIFY_API_URL'],
+            pool_size=config['SPOTIFY_POOL_SIZE'],
+            connect_timeout=config['SPOTIFY_CONNECT_TIMEOUT'],
+            read_timeout=config['SPOTIFY_READ_TIMEOUT'],
+            max_retries=config['SPOTIFY_MAX_RETRIES'],
+            backoff=config['SPOTIFY_BACKOFF'],
+            max_backoff=config['SPOTIFY_MAX_BACKOFF'],
+            cache_ttls={
+                'me': config['SPOTIFY_PROFILE_TTL'],
+                'me/top/artists': config['SPOTIFY_TOP_ITEMS_TTL'],
+                'me/top/tracks': config['SPOTIFY_TOP_ITEMS_TTL']
+            },
+            cache_size=config['SPOTIFY_CACHE_SIZE'],
+            stale_while_revalidate=config['SPOTIFY_STALE_WHILE_REVALIDATE'],
+            recommendations_ttl=config['SPOTIFY_RECOMMENDATIONS_TTL']
+        )
+
+    def _url(self, path):
+        if path.startswith(('http://', 'https://')):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _backoff(self, attempt):
+        # Full jitter: anywhere up to the exponential step, so clients that
+        # failed together do not retry together
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def _retry_after(self, response, attempt):
+        try:
+            delay = float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return self._backoff(attempt)
+        return delay + random.uniform(0, self.backoff)
+
+    def _retry_delay(self, method, attempt, response=None, sent=True):
+        # Seconds to wait before retrying a failed attempt, or None to give up.
+        # Without a response, the call failed in transport; `sent` is False
+        # when it never reached the server (connect timeout).
+        if attempt >= self.max_retries:
+            return None
+        if response is None:
+            return self._backoff(attempt) if method in _IDEMPOTENT or not sent else None
+        if response.status_code == 429:
+            delay = self._retry_after(response, attempt)
+            return delay if delay <= self.max_backoff else None
+        if response.status_code >= 500 and method in _IDEMPOTENT:
+            return self._backoff(attempt)
+        return None
+
+    def _cache_state(self, entry):
+        # 'fresh' entries are served as they are, 'stale' ones are served while
+        # they refresh in the background, and anything else is refetched
+        if entry is None:
+            return None
+        age = time.time() - entry.fetched_at
+        if age < entry.ttl:
+            return 'fresh'
+        if age < entry.ttl + self.stale_while_revalidate:
+            return 'stale'
+        return None
+
+    def _start_refresh(self, key):
+        # Claims the background refresh of a key; False if one is already running
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _end_refresh(self, key):
+        with self._refreshing_lock:
+            self._refreshing.discard(key)
+
+    def request(self, method, path, token=None, headers=None, **kwargs):
+        """
+        Sends a request and returns the successful requests.Response.
+
+        Args:
+            method (str): HTTP method.
+            path (str): Path below base_url, or an absolute URL.
+            token (str, optional): Access token sent as a Bearer authorization.
+            headers (dict, optional): Extra request headers.
+            **kwargs: Passed on to requests (params, json, data, ...).
+
+        Raises:
+            SpotifyError: If the call still fails after the allowed retries.
+        """
+        method = method.upper()
+        headers = dict(headers or {})
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+        url = self._url(path)
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                sent = not isinstance(e, requests.exceptions.ConnectTimeout)
+                delay = self._retry_delay(method, attempt, sent=sent)
+                if delay is None:
+                    raise SpotifyError(f"Request to Spotify failed: {e}") from e
+            else:
+                if response.status_code < 400:
+                    return response
+                delay = self._retry_delay(method, attempt, response)
+                if delay is None:
+                    raise SpotifyError.from_response(response)
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _json(response):
+        if not response.content:
+            return None
+        try:
+            return response.json()
+        except ValueError as e:
+            raise SpotifyError("Spotify returned a response that is not JSON", response.status_code) from e
+
+    def get(self, path, token=None, params=None, **kwargs):
+        ttl = self.cache_ttls.get(path)
+        if ttl and token and not params and not kwargs:
+            return self._cached_get(path, token, ttl)
+        return self._json(self.request('GET', path, token, params=params, **kwargs))
+
+    def _cached_get(self, path, token, ttl):
+        key = (token, path)
+        entry = self.cache.get(key)
+        state = self._cache_state(entry)
+        if state == 'stale' and self._start_refresh(key):
+            self._executor.submit(self._refresh, key, entry, ttl)
+        if state is not None:
+            return entry.body
+        return self._revalidate(key, entry, ttl)
+
+    def _revalidate(self, key, entry, ttl):
+        token, path = key
+        headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else None
+        response = self.request('GET', path, token, headers=headers)
+        if response.status_code == 304:
+            body = entry.body
+        else:
+            body = self._json(response)
+        self.cache.put(key, body, response.headers.get('ETag', entry.etag if entry else None), ttl)
+        return body
+
+    def _refresh(self, key, entry, ttl):
+        try:
+            self._revalidate(key, entry, ttl)
+        except SpotifyError:
+            pass  # keep serving the stale entry until a refresh succeeds
+        finally:
+            self._end_refresh(key)
+
+    def post(self, path, token=None, json=None, **kwargs):
+        return self._json(self.request('POST', path, token, json=json, **kwargs))
+
+    def put(self, path, token=None, json=None, **kwargs):
+        return self._json(self.request('PUT', path, token, json=json, **kwargs))
+
+    def delete(self, path, token=None, json=None, **kwargs):
+        return self._json(self.request('DELETE', path, token, json=json, **kwargs))
+
+    def recommendations(self, token, seed_artists=None, seed_tracks=None, seed_genres=None, limit=10):
+        """
+        Returns /recommendations for a seed set, from the cache when possible.
+
+        Seeds may be lists of ids or comma-separated strings; order and
+        duplicates do not matter.
+
+        Raises:
+            SpotifyError: If the call fails.
+        """
+        key, params = recommendation_query(seed_artists, seed_tracks, seed_genres, limit)
+        entry = self._recommendations.get(key)
+        if entry is not None and time.time() - entry.fetched_at < entry.ttl:
+            return entry.body
+
+        def fetch():
+            body = self.get('recommendations', token, params=params)
+            if self.recommendations_ttl:
+                self._recommendations.put(key, body, ttl=self.recommendations_ttl)
+            return body
+
+        return self._flights.do(key, fetch)
+
+    def submit(self, method, path, token=None, **kwargs):
+        """
+        Starts a call in the background and returns a Future of its JSON body.
+        """
+        return self._executor.submit(self._json_request, method, path, token, **kwargs)
+
+    def _json_request(self, method, path, token=None, **kwargs):
+        if method.upper() == 'GET':
+            return self.get(path, token, **kwargs)
+        return self._json(self.request(method, path, token, **kwargs))
+
+    def get_all(self, paths, token=None):
+        """
+        GETs several paths concurrently and returns their JSON bodies in order.
+
+        Raises:
+            SpotifyError: The error of the first failed path, once every call has finished.
+        """
+        futures = [self.submit('GET', path, token) for path in paths]
+        wait(futures)
+        return [future.result() for future in futures]
+
+
+def _normalize_seeds(seeds):
+    if isinstance(seeds, str):
+        seeds = [seeds]
+    return tuple(sorted({seed.strip() for value in seeds or () for seed in value.split(',') if seed.strip()}))
+
+
+def recommendation_query(seed_artists=None, seed_tracks=None, seed_genres=None, limit=10):
+    """
+    Returns the cache key and query parameters of a /recommendations call.
+    """
+    seeds = tuple(_normalize_seeds(seeds) for seeds in (seed_artists, seed_tracks, seed_genres))
+    params = {name: ','.join(values) for name, values in zip(('seed_artists', 'seed_tracks', 'seed_genres'), seeds) if values}
+    params['limit'] = int(limit)
+    return seeds + (int(limit),), params
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Returns the process-wide client, created from Config on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                config = {key: getattr(Config, key) for key in dir(Config) if key.startswith('SPOTIFY_')}
+                _client = SpotifyClient.from_config(config)
+    return _client
@@ -1,41 +1,27 @@
-import os
-import json
 from collections import defaultdict, Counter
 
-# Load user data from JSON files
-def load_user_data():
-    users_data = {}
-    for filename in os.listdir('data'):
-        if filename.endswith('.json'):
-            with open(os.path.join('data', filename)) as f:
-                data = json.load(f)
-                # Check if data is a list, and if so, iterate through it
-                if isinstance(data, list):
-                    for user in data:
-                        users_data[user['username']] = user
-                elif isinstance(data, dict):
-                    users_data[data['username']] = data
-    return users_data
+from profile_store import get_profile_store
 
-users_data = load_user_data()
+users_data = get_profile_store()
 
-# Dictionary to count artist popularity and store users who listen to each artist
+# Dictionary to count artist popularity and store users who listen to each
+# artist, keyed by interned artist id so no profile has to be decoded
 artist_user_map = defaultdict(list)
 
-for username, user_data in users_data.items():
-    for artist in user_data.get('top_artists', []):
-        artist_user_map[artist].append(username)
+for profile in users_data.profiles():
+    for artist_id in profile.top_artists:
+        artist_user_map[artist_id].append(profile.username)
 
 # Rank artists by their popularity
-artist_counts = Counter({artist: len(users) for artist, users in artist_user_map.items()})
+artist_counts = Counter({artist_id: len(users) for artist_id, users in artist_user_map.items()})
 top_artists = artist_counts.most_common(5)
 
 # Output the top 5 artists and their top 5 listeners
 result = []
-for artist, count in top_artists:
-    top_users = artist_user_map[artist][:5]  # Get top 5 users for this artist
+for artist_id, count in top_artists:
+    top_users = artist_user_map[artist_id][:5]  # Get top 5 users for this artist
     result.append({
-        'artist': artist,
+        'artist': users_data.name(artist_id),
         'count': count,
         'top_users': top_users
     })
@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import time
+
+import h5py
+import numpy as np
+import tensorflow as tf
+
+from config import Config
+from model_bundle import ARTIFACT_VERSION
+from numpy_model import NumpySimilarityModel
+from user_matrix import UserMatrix
+from utils import load_user_data
+from vocabulary import Vocabulary
+
+
+def build_similarity_model(input_dim):
+    model = tf.keras.Sequential([
+        tf.keras.layers.Dense(128, activation='relu', input_shape=(input_dim,)),
+        tf.keras.layers.Dense(64, activation='relu'),
+        tf.keras.layers.Dense(1, activation='sigmoid')  # Output a similarity score between 0 and 1
+    ])
+    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+
+class PairSampler:
+    """
+    Samples batches of (|u_i - u_j|, label) training pairs from a user matrix.
+
+    Pair vectors are built a batch at a time from the binary feature rows, so
+    memory is bounded by batch_size rather than the number of user pairs.
+    A pair is labelled 1 when both users have identical feature sets. Such
+    pairs are rare, so positive_fraction of each batch is drawn from groups of
+    identical users (when any exist) and the rest from uniformly random pairs.
+    """
+
+    def __init__(self, user_matrix, batch_size=32, positive_fraction=0.5, seed=None):
+        matrix, live, _ = user_matrix.snapshot()
+        self.features = (matrix[np.flatnonzero(live)] != 0).astype(np.float32).tocsr()
+        self.n_users, self.n_features = self.features.shape
+        if self.n_users < 2:
+            raise ValueError("At least two users are needed to sample pairs")
+
+        self.batch_size = batch_size
+        self._rng = np.random.default_rng(seed)
+
+        groups = {}
+        indptr, indices = self.features.indptr, self.features.indices
+        for row in range(self.n_users):
+            groups.setdefault(indices[indptr[row]:indptr[row + 1]].tobytes(), []).append(row)
+        groups = [rows for rows in groups.values() if len(rows) > 1]
+
+        self.positive_fraction = positive_fraction if groups else 0.0
+        if groups:
+            self._group_sizes = np.array([len(rows) for rows in groups])
+            self._group_offsets = np.concatenate([[0], np.cumsum(self._group_sizes)[:-1]])
+            self._group_members = np.concatenate(groups)
+            pair_counts = self._group_sizes * (self._group_sizes - 1) / 2
+            self._group_weights = pair_counts / pair_counts.sum()
+
+    def _distinct(self, sizes, count):
+        first = (self._rng.random(count) * sizes).astype(np.int64)
+        second = (self._rng.random(count) * (sizes - 1)).astype(np.int64)
+        return first, second + (second >= first)
+
+    def sample_pairs(self, count):
+        """
+        Returns two index arrays of distinct users forming `count` pairs.
+        """
+        positives = self._rng.binomial(count, self.positive_fraction) if self.positive_fraction else 0
+        left, right = self._distinct(np.full(count - positives, self.n_users), count - positives)
+
+        if positives:
+            groups = self._rng.choice(len(self._group_sizes), positives, p=self._group_weights)
+            first, second = self._distinct(self._group_sizes[groups], positives)
+            offsets = self._group_offsets[groups]
+            left = np.concatenate([left, self._group_members[offsets + first]])
+            right = np.concatenate([right, self._group_members[offsets + second]])
+
+        return left, right
+
+    def batch(self):
+        left, right = self.sample_pairs(self.batch_size)
+        pairs = abs(self.features[left] - self.features[right])
+        labels = (pairs.getnnz(axis=1) == 0).astype(np.float32)
+        return pairs.toarray(), labels
+
+    def __iter__(self):
+        while True:
+            yield self.batch()
+
+    def dataset(self):
+        return tf.data.Dataset.from_generator(
+            self.__iter__,
+            output_signature=(
+                tf.TensorSpec(shape=(None, self.n_features), dtype=tf.float32),
+                tf.TensorSpec(shape=(None,), dtype=tf.float32)
+            )
+        ).prefetch(tf.data.AUTOTUNE)
+
+
+def train_similarity_model(user_matrix, pairs_per_epoch=50000, epochs=10, batch_size=32, seed=None):
+    """
+    Trains the similarity model on pairs streamed from a user matrix.
+
+    Args:
+        user_matrix (UserMatrix): Users to sample pairs from.
+        pairs_per_epoch (int, optional): Pair budget per epoch, capped at the number
+            of distinct user pairs. Defaults to 50000.
+        epochs (int, optional): Number of epochs. Defaults to 10.
+        batch_size (int, optional): Pairs per batch. Defaults to 32.
+        seed (int, optional): Seed for the pair sampler. Defaults to None.
+
+    Returns:
+        tf.keras.Model: The trained model.
+    """
+    sampler = PairSampler(user_matrix, batch_size=batch_size, seed=seed)
+    n_pairs = min(pairs_per_epoch, sampler.n_users * (sampler.n_users - 1) // 2)
+
+    model = build_similarity_model(sampler.n_features)
+    model.fit(sampler.dataset(), epochs=epochs, steps_per_epoch=max(n_pairs // batch_size, 1))
+
+    return model
+
+
+def write_artifact_metadata(f, entries, version):
+    f.attrs['artifact_version'] = ARTIFACT_VERSION
+    f.attrs['model_version'] = version
+    f.attrs['vocabulary'] = json.dumps(entries)
+    if 'mappings' in f.attrs:
+        del f.attrs['mappings']
+
+def entries_from_mappings(mappings):
+    """
+    Converts the per-kind index mappings of older artifacts into vocabulary
+    entries. Their columns were all artists, then all songs, then all genres,
+    which is exactly the id order of the returned entries.
+    """
+    entries = []
+    for key, kind in (('artists', 'artist'), ('songs', 'song'), ('genres', 'genre')):
+        entries.extend([kind, name] for name, _ in sorted(mappings[key].items(), key=lambda item: item[1]))
+    return entries
+
+def export_inference_weights(model, f):
+    """
+    Writes the model's layer weights to the `inference` group for NumpySimilarityModel.
+    """
+    if 'inference' in f:
+        del f['inference']
+    NumpySimilarityModel.from_keras(model).save(f.create_group('inference'))
+
+def save_model_artifact(model, path, entries):
+    """
+    Saves a trained model and the vocabulary entries it was trained with as one file.
+
+    The model is written in Keras H5 format, with its inference weights
+    exported alongside for TensorFlow-free serving, and the entries, artifact
+    format version and a model version stamp stored as file attributes. The
+    file is written next to the target and renamed into place, so a running
+    app never sees a half-written artifact.
+
+    Returns:
+        str: The model version stamp.
+    """
+    version = time.strftime('%Y%m%d%H%M%S', time.gmtime())
+    root, ext = os.path.splitext(path)
+    # Unique per process, so concurrent trainings never write the same file
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+
+    model.save(tmp_path)
+    with h5py.File(tmp_path, 'a') as f:
+        export_inference_weights(model, f)
+        write_artifact_metadata(f, entries, version)
+    os.replace(tmp_path, path)
+    return version
+
+def export_artifact(path):
+    """
+    Upgrades an artifact saved by an earlier training.py in place by exporting
+    its inference weights and storing its mappings as vocabulary entries. Its
+    model version is kept.
+
+    Raises:
+        ValueError: If the file records neither a vocabulary nor mappings, so
+            the features its inputs stand for are unknown.
+    """
+    with h5py.File(path, 'r') as f:
+        if 'vocabulary' in f.attrs:
+            entries = json.loads(f.attrs['vocabulary'])
+        elif 'mappings' in f.attrs:
+            entries = entries_from_mappings(json.loads(f.attrs['mappings']))
+        else:
+            raise ValueError(f"{path} does not record the features it was trained on, so it cannot be exported; "
+                             "retrain it with `python training.py`")
+        version = f.attrs.get('model_version') or time.strftime('%Y%m%d%H%M%S', time.gmtime(os.path.getmtime(path)))
+
+    model = tf.keras.models.load_model(path, compile=False)
+    with h5py.File(path, 'a') as f:
+        export_inference_weights(model, f)
+        write_artifact_metadata(f, entries, version)
+    return version
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the similarity model and save it with its vocabulary.")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--vocabulary', default=Config.VOCABULARY_PATH)
+    parser.add_argument('--output', default=Config.MODEL_PATH)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--pairs-per-epoch', type=int, default=Config.TRAIN_PAIRS_PER_EPOCH)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--export', metavar='ARTIFACT',
+                        help="export inference weights from an existing artifact instead of training")
+    args = parser.parse_args()
+
+    if args.export:
+        try:
+            version = export_artifact(args.export)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Exported inference weights for model version {version} in {args.export}")
+        return
+
+    users_data = load_user_data(args.data_dir)
+    vocabulary = Vocabulary(args.vocabulary)
+    user_matrix = UserMatrix.from_users(users_data, vocabulary)
+    entries = vocabulary.entries(user_matrix.n_features)
+    model = train_similarity_model(user_matrix, args.pairs_per_epoch, args.epochs, args.batch_size, args.seed)
+
+    version = save_model_artifact(model, args.output, entries)
+    print(f"Saved model version {version} ({len(users_data)} users, {user_matrix.n_features} features) to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
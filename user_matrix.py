@@ -0,0 +1,294 @@
+import threading
+
+import numpy as np
+from scipy import sparse
+
+from vocabulary import feature_keys
+
+
+def top_k(scores, k):
+    """
+    Returns the indices of the k highest scores, best first.
+
+    Uses argpartition so only the selected k entries are sorted.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+def named_features(data):
+    """
+    Returns a profile's row as {(kind, name): value}, normalized as UserMatrix.encode() does.
+
+    Unlike feature ids, which only hold within one process's vocabulary,
+    names can be stored and shared between processes.
+    """
+    keys = feature_keys(data)
+    value = float(1 / np.sqrt(max(len(keys), 1)))
+    return {key: value for key in keys}
+
+def _dense(indices, values, size):
+    vector = np.zeros(size, dtype=np.float32)
+    # Ids assigned since the matrix was last widened are in no row yet
+    inside = indices < size
+    vector[indices[inside]] = values[inside]
+    return vector
+
+def _grow(array, needed):
+    if needed <= len(array):
+        return array
+    grown = np.empty(max(needed, 2 * len(array), 16), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class UserMatrix:
+    """
+    Sparse (CSR) user-feature matrix with one L2-normalized row per user.
+
+    Columns are Vocabulary feature ids, so a dot product between two rows is
+    the users' cosine similarity, and new artists, songs or genres only add
+    columns. Rows are appended in place; re-adding a known user retires the old
+    row, and retired rows are compacted away once they outnumber the live ones.
+
+    Each row also carries its user's neighbour threshold: the lowest cosine
+    similarity in their cached top-k list, -inf while the list is not full, and
+    +inf when no list is being maintained.
+    """
+
+    def __init__(self, vocabulary):
+        self.vocabulary = vocabulary
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._indptr = np.zeros(1, dtype=np.int32)
+        self._indices = np.empty(0, dtype=np.int32)
+        self._data = np.empty(0, dtype=np.float32)
+        self._live = np.empty(0, dtype=bool)
+        self._thresholds = np.empty(0, dtype=np.float32)
+        self._n_rows = 0
+        self._nnz = 0
+        self._retired = 0
+        self._usernames = []
+        self._rows = {}  # {username: row}
+
+    @property
+    def n_features(self):
+        return len(self.vocabulary)
+
+    @classmethod
+    def from_users(cls, users_data, vocabulary):
+        matrix = cls(vocabulary)
+        # Copy the items first: users_data may gain users while rows are encoded
+        matrix.extend(list(users_data.items()))
+        return matrix
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, username):
+        return username in self._rows
+
+    def encode(self, data, grow=False):
+        """
+        Returns the sorted column indices and L2-normalized values of a user's row.
+
+        With grow, names the vocabulary has not seen yet are added to it.
+        """
+        indices = self.vocabulary.encode(data, grow=grow)
+        values = np.full(len(indices), 1 / np.sqrt(max(len(indices), 1)), dtype=np.float32)
+        return indices, values
+
+    def upsert(self, username, data):
+        self.extend([(username, data)])
+
+    def extend(self, items):
+        encoded = [(username, self.encode(data, grow=True)) for username, data in items]
+        if not encoded:
+            return
+
+        with self._lock:
+            n_rows = self._n_rows + len(encoded)
+            nnz = self._nnz + sum(len(indices) for _, (indices, _) in encoded)
+            self._indptr = _grow(self._indptr, n_rows + 1)
+            self._indices = _grow(self._indices, nnz)
+            self._data = _grow(self._data, nnz)
+            self._live = _grow(self._live, n_rows)
+            self._thresholds = _grow(self._thresholds, n_rows)
+
+            for username, (indices, values) in encoded:
+                previous = self._rows.get(username)
+                threshold = np.inf
+                if previous is not None:
+                    threshold = self._thresholds[previous]
+                    self._retire(previous)
+
+                row, start = self._n_rows, self._nnz
+                end = start + len(indices)
+                self._indices[start:end] = indices
+                self._data[start:end] = values
+                self._indptr[row + 1] = end
+                self._live[row] = True
+                self._thresholds[row] = threshold
+                self._usernames.append(username)
+                self._rows[username] = row
+                self._n_rows, self._nnz = row + 1, end
+
+            if self._retired > max(len(self._rows), 1024):
+                self._compact()
+
+    def _retire(self, row):
+        self._live[row] = False
+        self._data[self._indptr[row]:self._indptr[row + 1]] = 0
+        self._retired += 1
+
+    def _compact(self):
+        matrix, live, usernames = self._snapshot()
+        keep = np.flatnonzero(live)
+        matrix = matrix[keep]
+        thresholds = self._thresholds[keep]
+        self._reset()
+        self._indptr = matrix.indptr.astype(np.int32)
+        self._indices = matrix.indices.astype(np.int32)
+        self._data = matrix.data.astype(np.float32)
+        self._live = np.ones(len(keep), dtype=bool)
+        self._thresholds = thresholds
+        self._n_rows, self._nnz = len(keep), matrix.nnz
+        self._usernames = [usernames[row] for row in keep]
+        self._rows = {username: row for row, username in enumerate(self._usernames)}
+
+    def _snapshot(self):
+        # Views over the current buffers; appends only write past the snapshot
+        # and reallocation leaves the old buffers intact for readers.
+        n_rows, nnz = self._n_rows, self._nnz
+        matrix = sparse.csr_matrix(
+            (self._data[:nnz], self._indices[:nnz], self._indptr[:n_rows + 1]),
+            shape=(n_rows, self.n_features),
+            copy=False
+        )
+        return matrix, self._live[:n_rows], self._usernames
+
+    def snapshot(self):
+        """
+        Returns (matrix, live_mask, usernames) for the rows present right now.
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def scores(self, data, exclude=None):
+        """
+        Returns cosine scores of a profile against every row, plus the matching
+        usernames. Retired rows and the excluded user score -inf.
+        """
+        indices, values = self.encode(data)
+        return self.vector_scores(indices, values, [exclude] if exclude is not None else ())
+
+    def vector_scores(self, indices, values, exclude=()):
+        """
+        Returns dot products of a sparse feature vector with every row, plus the
+        matching usernames. Retired rows and the excluded users score -inf.
+        """
+        with self._lock:
+            matrix, live, usernames = self._snapshot()
+            excluded = [self._rows[username] for username in exclude if username in self._rows]
+        scores = matrix @ _dense(indices, values, matrix.shape[1])
+        scores[~live] = -np.inf
+        scores[excluded] = -np.inf
+        return scores, usernames
+
+    def set_thresholds(self, items):
+        """
+        Sets the neighbour thresholds of known users from (username, threshold) pairs.
+        """
+        items = list(items)
+        with self._lock:
+            for username, threshold in items:
+                row = self._rows.get(username)
+                if row is not None:
+                    self._thresholds[row] = threshold
+
+    def reverse_neighbours(self, data, exclude=None):
+        """
+        Returns the (username, cosine similarity) pairs of users whose cached
+        top-k list a profile now belongs in, i.e. whose similarity to it beats
+        their neighbour threshold. One matrix-vector product covers every row.
+        """
+        indices, values = self.encode(data)
+        with self._lock:
+            matrix, live, usernames = self._snapshot()
+            thresholds = self._thresholds[:len(usernames)].copy()
+            excluded = self._rows.get(exclude)
+        scores = matrix @ _dense(indices, values, matrix.shape[1])
+        beaten = live & (scores > thresholds)
+        if excluded is not None:
+            beaten[excluded] = False
+        rows = np.flatnonzero(beaten)
+        return [(usernames[row], float(scores[row])) for row in rows]
+
+    def candidate_scores(self, data, candidates):
+        """
+        Returns cosine scores of a profile against the given usernames only.
+        """
+        indices, values = self.encode(data)
+        with self._lock:
+            matrix, _, _ = self._snapshot()
+            # Rows are looked up under the lock, so they match the snapshot
+            usernames = [username for username in candidates if username in self._rows]
+            selected = np.array([self._rows[username] for username in usernames], dtype=np.int64)
+        return matrix[selected] @ _dense(indices, values, matrix.shape[1]), usernames
+
+    def pair_vectors(self, data, usernames, n_features=None):
+        """
+        Returns the binary |u - c| rows (CSR) between a profile and each of the
+        given users, the pair layout the similarity model is trained on.
+
+        n_features keeps only the first feature columns, for a model trained
+        before the vocabulary grew.
+        """
+        indices, _ = self.encode(data)
+        with self._lock:
+            matrix, _, _ = self._snapshot()
+            # Rows are looked up under the lock, so they match the snapshot
+            selected = np.array([self._rows[username] for username in usernames], dtype=np.int64)
+        selected = matrix[selected]
+
+        n = len(usernames)
+        repeated = sparse.csr_matrix(
+            (np.ones(n * len(indices), dtype=np.float32), np.tile(indices, n), np.arange(n + 1) * len(indices)),
+            shape=selected.shape
+        )
+        pairs = abs((selected != 0).astype(np.float32) - repeated)
+        return pairs if n_features is None else pairs[:, :n_features]
+
+    def nearest(self, indices, values, k=10, exclude=(), norm=None):
+        """
+        Returns up to k (username, cosine similarity) pairs closest to a sparse
+        feature vector, such as a centroid of user rows, most similar first.
+
+        Pass norm when the vector had features outside the vocabulary dropped;
+        they add nothing to the products but still count in its length.
+        """
+        if norm is None:
+            norm = np.linalg.norm(values)
+        if not norm:
+            return []
+        scores, usernames = self.vector_scores(indices, values, exclude)
+        return [(usernames[i], float(scores[i] / norm)) for i in top_k(scores, k) if scores[i] > -np.inf]
+
+    def most_similar(self, data, k=10, exclude=None, candidates=None):
+        """
+        Returns up to k (username, cosine similarity) pairs, most similar first.
+
+        When candidates is given, only those usernames are scored.
+        """
+        if candidates is None:
+            scores, usernames = self.scores(data, exclude)
+        else:
+            scores, usernames = self.candidate_scores(data, [user for user in candidates if user != exclude])
+        return [(usernames[i], float(scores[i])) for i in top_k(scores, k) if scores[i] > -np.inf]
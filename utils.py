@@ -1,4 +1,10 @@
-import requests
+from profile_store import ProfileStore
+from spotify_client import SpotifyError, get_client
+
+# Load user data from JSON files; the web app shares one store through
+# profile_store.get_profile_store() instead
+def load_user_data(data_dir='data'):
+    return ProfileStore.from_dir(data_dir)
 
 def get_recommendations(token, seed_artists=None, seed_tracks=None, seed_genres=None, limit=10):
     """
@@ -17,36 +23,12 @@ def get_recommendations(token, seed_artists=None, seed_tracks=None, seed_genres=
     if not token:
         return {'error': 'Access token is required'}
 
-    headers = {
-        'Authorization': f"Bearer {token}"
-    }
-
-    params = {
-        'seed_artists': ','.join(seed_artists) if seed_artists else '',
-        'seed_tracks': ','.join(seed_tracks) if seed_tracks else '',
-        'seed_genres': ','.join(seed_genres) if seed_genres else '',
-        'limit': limit
-    }
-
-    # Remove empty parameters
-    params = {k: v for k, v in params.items() if v}
-
     try:
-        response = requests.get(
-            'https://api.spotify.com/v1/recommendations',
-            headers=headers,
-            params=params
-        )
-        response.raise_for_status()  # Raises an HTTPError if the response was unsuccessful
-    except requests.exceptions.RequestException as e:
+        recommendations = get_client().recommendations(token, seed_artists, seed_tracks, seed_genres, limit)
+    except SpotifyError as e:
         return {'error': f"Request failed: {e}"}
 
-    try:
-        recommendations = response.json()
-    except ValueError:
-        return {'error': 'Failed to parse response as JSON'}
-
-    if 'tracks' not in recommendations:
+    if not recommendations or 'tracks' not in recommendations:
         return {'error': 'No recommendations found'}
 
     return recommendations
@@ -0,0 +1,132 @@
+import fcntl
+import json
+import os
+import threading
+
+import numpy as np
+
+# Profile fields that become features, and the kind each one is filed under
+FEATURE_FIELDS = (('top_artists', 'artist'), ('top_songs', 'song'), ('genres', 'genre'))
+
+
+def feature_keys(data):
+    """
+    Returns the set of (kind, name) features of a profile.
+    """
+    return {(kind, name) for field, kind in FEATURE_FIELDS for name in data[field]}
+
+
+class Vocabulary:
+    """
+    Append-only index of artist/song/genre names to feature ids.
+
+    Ids are handed out on first sight and never change, so a user-feature
+    matrix only gains columns as the catalogue grows and existing rows stay
+    valid. New entries are appended to a JSON-lines file, one [kind, name]
+    pair per line; on load, ids follow the order of first appearance.
+
+    The file is the single source of ids for every process sharing it (web
+    workers, the training child). New ids are handed out under an exclusive
+    lock on the file, after reading whatever other processes appended, so
+    an id means the same feature everywhere and after a restart.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._ids = {}  # {(kind, name): id}
+        self._entries = []
+        self._offset = 0  # bytes of the file read so far
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self._read_new(f)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _assign(self, key):
+        if key not in self._ids:
+            self._ids[key] = len(self._entries)
+            self._entries.append(key)
+            return True
+        return False
+
+    def _read_new(self, f):
+        # Assigns the entries appended since the last read, in file order; a
+        # line without its newline is still being written and is left for later
+        f.seek(self._offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            self._offset += len(line)
+            if line.strip():
+                self._assign(tuple(json.loads(line)))
+
+    def get(self, kind, name):
+        return self._ids.get((kind, name))
+
+    def entries(self, limit=None):
+        """
+        Returns the [kind, name] entries in id order, optionally only the first `limit`.
+        """
+        return [list(key) for key in self._entries[:limit]]
+
+    def starts_with(self, entries):
+        """
+        Checks whether the first ids of this vocabulary are exactly `entries`.
+        """
+        return len(entries) <= len(self._entries) and all(
+            tuple(entry) == key for entry, key in zip(entries, self._entries)
+        )
+
+    def refresh(self):
+        """
+        Picks up the entries other processes appended since the last read.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    self._read_new(f)
+            except FileNotFoundError:
+                pass
+
+    def extend(self, keys):
+        """
+        Assigns ids to any unseen (kind, name) keys and persists them.
+        """
+        with self._lock:
+            if not self.path:
+                for key in map(tuple, keys):
+                    self._assign(key)
+                return
+            with open(self.path, 'a+b') as f:
+                # Held until the file is closed
+                fcntl.flock(f, fcntl.LOCK_EX)
+                self._read_new(f)
+                added = [key for key in map(tuple, keys) if self._assign(key)]
+                if added:
+                    lines = b''.join(json.dumps(key).encode('utf-8') + b'\n' for key in added)
+                    f.write(lines)
+                    self._offset += len(lines)
+
+    def encode(self, data, grow=False):
+        """
+        Returns the sorted, unique feature ids of a profile.
+
+        With grow, unseen names get new ids; otherwise they are skipped.
+        """
+        ids = [feature_id for feature_id in self.lookup(feature_keys(data), grow) if feature_id is not None]
+        return np.array(sorted(ids), dtype=np.int32)
+
+    def lookup(self, keys, grow=False):
+        """
+        Returns the ids of (kind, name) keys, in order; unseen keys get new ids
+        with grow and None otherwise.
+        """
+        keys = list(keys)
+        if grow and any(key not in self._ids for key in keys):
+            self.extend(sorted(keys))
+        return [self._ids.get(key) for key in keys]